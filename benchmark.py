@@ -0,0 +1,299 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from mock_api import WIKI_PATH, MockApi
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Settings applied on top of config.json for every scenario: no rate limiting, cache
+# or proxies, so the numbers measure the scrapers themselves
+BENCHMARK_CONFIG = {
+    'rate_limit_per_second': 0,
+    'wiki_rate_limit_per_second': 0,
+    'http_cache': False,
+    'http_cache_offline': False,
+    'proxy_enabled': False,
+    'comments_refresh': False,
+    'id_discovery': False,
+    'start_id': 1,
+    # Failed profiles are retried within the run after a short backoff, so the
+    # flaky scenario measures the retries rather than the production backoff sleeps
+    'retry_base_delay': 0.05,
+    'retry_max_wait': 5
+}
+
+# Built-in scenarios. `target` is 'profiles' (main.py) or 'wiki' (wikipedia.py),
+# `profiles` the number of IDs or pages, `server` the MockApi options and `config`
+# the config.json overrides.
+SCENARIOS = {
+    'threads': {'target': 'profiles', 'profiles': 500, 'config': {'fetch_mode': 'threads'}},
+    'async': {'target': 'profiles', 'profiles': 500, 'config': {'fetch_mode': 'async'}},
+    'pipeline': {'target': 'profiles', 'profiles': 500, 'config': {'fetch_mode': 'pipeline'}},
+    'many_comments': {'target': 'profiles', 'profiles': 200, 'server': {'comment_pages': 10}},
+    'flaky': {'target': 'profiles', 'profiles': 500,
+              'server': {'error_rate': 0.03, 'throttle_rate': 0.01, 'retry_after': 0.5, 'slow_rate': 0.02}},
+    'wiki_batched': {'target': 'wiki', 'profiles': 400, 'config': {'wiki_batch_size': 20}},
+    'wiki_single': {'target': 'wiki', 'profiles': 100, 'config': {'wiki_batch_size': 1}}
+}
+
+# Metrics compared between result files; True when higher is better
+COMPARED_METRICS = {
+    'profiles_per_sec': True,
+    'requests_per_sec': True,
+    'latency_p50': False,
+    'latency_p99': False,
+    'peak_rss_mb': False,
+    'db_write_time': False
+}
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(fraction * len(values)), len(values) - 1)], 4)
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def count_rows(table):
+    conn = sqlite3.connect('personality_profiles.db')
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        conn.close()
+
+# Function to scrape profiles 1..num_profiles_to_scrape through main.run_profiles
+# (fetch_and_process_profiles or its async/pipeline variant, per fetch_mode)
+def run_profiles_target():
+    import main
+    latencies = []
+    record_response = main.record_response
+
+    def timed_record_response(started, status, *args, **kwargs):
+        latencies.append(time.monotonic() - started)
+        record_response(started, status, *args, **kwargs)
+    main.record_response = timed_record_response
+
+    profile_ids = main.fetch_all_profile_ids(main.config.get('start_id', 1))
+    started = time.perf_counter()
+    try:
+        main.run_profiles(profile_ids)
+        main.db.flush()
+        elapsed = time.perf_counter() - started
+    finally:
+        main.store.close()
+        main.db.close()
+        if main.metrics_exporter:
+            main.metrics_exporter.close()
+    return {
+        'elapsed': elapsed,
+        'profiles_done': len(main.processed_ids),
+        'missing': len(main.missing_ids),
+        'errors': count_rows('errors'),
+        'latencies': latencies,
+        'db': main.db.stats()
+    }
+
+# Function to look up pages "Person 1".."Person N" through wikipedia.main
+def run_wiki_target(count):
+    conn = sqlite3.connect('personality_profiles.db')
+    conn.execute('CREATE TABLE IF NOT EXISTS profiles (id INTEGER PRIMARY KEY, mbti_profile TEXT, property_id INTEGER)')
+    conn.executemany('INSERT OR REPLACE INTO profiles (id, mbti_profile, property_id) VALUES (?, ?, 1)',
+                     [(celeb_id, f"Person {celeb_id}") for celeb_id in range(1, count + 1)])
+    conn.commit()
+    conn.close()
+
+    import wikipedia
+    latencies = []
+    wikipedia.wiki_wiki._session.hooks['response'].append(
+        lambda response, *args, **kwargs: latencies.append(response.elapsed.total_seconds()))
+    started = time.perf_counter()
+    wikipedia.main()
+    elapsed = time.perf_counter() - started
+    return {
+        'elapsed': elapsed,
+        'profiles_done': count_rows('wiki_completed'),
+        'errors': count_rows('wiki_errors'),
+        'latencies': latencies,
+        'db': wikipedia.db.stats()
+    }
+
+# Function to run one target in this process (started by run_scenario in the
+# scenario's working directory) and write its measurements to result.json
+def worker(target, count):
+    measured = run_profiles_target() if target == 'profiles' else run_wiki_target(count)
+    latencies = measured.pop('latencies')
+    db_stats = measured.pop('db')
+    measured.update(
+        latency_p50=percentile(latencies, 0.5),
+        latency_p99=percentile(latencies, 0.99),
+        timed_requests=len(latencies),
+        db_write_time=db_stats['write_time'],
+        db_rows=db_stats['rows'],
+        db_batches=db_stats['batches'],
+        peak_rss_mb=peak_rss_mb()
+    )
+    with open('result.json', 'w') as f:
+        json.dump(measured, f)
+
+# Function to run a scenario against a fresh MockApi in a fresh working directory,
+# with the scraper in its own process so memory and module state start clean
+def run_scenario(name, scenario, base_config, timeout=1800, keep=False):
+    api = MockApi(**scenario.get('server', {})).start()
+    workdir = tempfile.mkdtemp(prefix=f'benchmark-{name}-')
+    count = scenario.get('profiles', 500)
+    config = dict(base_config, **BENCHMARK_CONFIG)
+    config.update(scenario.get('config', {}))
+    config.update(api_base_url=api.url, wiki_api_url=api.url + WIKI_PATH, num_profiles_to_scrape=count)
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(config, f, indent=2)
+
+    target = scenario.get('target', 'profiles')
+    logging.info(f"Running scenario {name} ({target}, {count} profiles) in {workdir}")
+    try:
+        with open(os.path.join(workdir, 'worker.log'), 'w') as log:
+            subprocess.run([sys.executable, os.path.join(REPO_DIR, 'benchmark.py'), 'worker', target, str(count)],
+                           cwd=workdir, stdout=log, stderr=subprocess.STDOUT, timeout=timeout, check=True)
+        with open(os.path.join(workdir, 'result.json')) as f:
+            result = json.load(f)
+    except (subprocess.SubprocessError, OSError) as e:
+        logging.error(f"Scenario {name} failed: {str(e)}; see {os.path.join(workdir, 'worker.log')}")
+        keep = True
+        return None
+    finally:
+        api.stop()
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    server = api.stats()
+    elapsed = result['elapsed']
+    result.update(
+        target=target,
+        profiles=count,
+        elapsed=round(elapsed, 3),
+        profiles_per_sec=round(result['profiles_done'] / elapsed, 2),
+        requests=server['requests'],
+        requests_per_sec=round(server['requests'] / elapsed, 2),
+        server=server,
+        server_options=scenario.get('server', {}),
+        config=scenario.get('config', {})
+    )
+    logging.info(f"{name}: {result['profiles_per_sec']} profiles/s, {result['requests_per_sec']} requests/s, "
+                 f"p50 {result['latency_p50']}s, p99 {result['latency_p99']}s, peak RSS {result['peak_rss_mb']} MB, "
+                 f"SQLite writes {result['db_write_time']}s")
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (subprocess.SubprocessError, OSError):
+        return None
+
+# Function to print every compared metric of the scenarios found in both result
+# files; returns the regressions larger than `threshold` (a fraction)
+def compare(old, new, threshold):
+    regressions = []
+    for name in sorted(set(old['scenarios']) & set(new['scenarios'])):
+        print(f"{name}:")
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before = old['scenarios'][name].get(metric)
+            after = new['scenarios'][name].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            flag = '  REGRESSION' if worse > threshold else ''
+            print(f"  {metric:18} {before:>10} -> {after:>10}  {change:+.1%}{flag}")
+            if flag:
+                regressions.append((name, metric, change))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scrapers against a local mock API")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help="Run scenarios and save the results as JSON")
+    run_parser.add_argument('--scenario', action='append', help="Scenario to run (repeatable; default: all)")
+    run_parser.add_argument('--scenarios-file', help="JSON file of extra or overriding scenarios")
+    run_parser.add_argument('--profiles', type=int, help="Override the number of profiles of every scenario")
+    run_parser.add_argument('--output', help="Result file (default: data/benchmarks/<timestamp>.json)")
+    run_parser.add_argument('--timeout', type=int, default=1800, help="Seconds allowed per scenario")
+    run_parser.add_argument('--keep', action='store_true', help="Keep the scenario working directories")
+    compare_parser = subparsers.add_parser('compare', help="Compare two result files")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help="Change that counts as a regression")
+    worker_parser = subparsers.add_parser('worker', help="Run one scenario target (used internally by run)")
+    worker_parser.add_argument('target', choices=['profiles', 'wiki'])
+    worker_parser.add_argument('count', type=int)
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        worker(args.target, args.count)
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(old, new, args.threshold)
+        if regressions:
+            logging.warning(f"{len(regressions)} metrics regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+        return
+
+    with open('config.json') as f:
+        base_config = json.load(f)
+    scenarios = dict(SCENARIOS)
+    if args.scenarios_file:
+        with open(args.scenarios_file) as f:
+            scenarios.update(json.load(f))
+    names = args.scenario or list(scenarios)
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (available: {', '.join(scenarios)})")
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scenarios': {}
+    }
+    for name in names:
+        scenario = dict(scenarios[name])
+        if args.profiles:
+            scenario['profiles'] = args.profiles
+        result = run_scenario(name, scenario, base_config, args.timeout, args.keep)
+        if result is not None:
+            results['scenarios'][name] = result
+
+    output = args.output or os.path.join('data', 'benchmarks', f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    logging.info(f"Saved results of {len(results['scenarios'])} scenarios to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import json
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_integer_dtype, is_numeric_dtype
+
+SCHEMA_KEY = '__schema__'
+
+# Columnar export in a compressed .npz archive, one or more typed arrays per column:
+# - numbers keep their dtype (integers downcast to the smallest that fits)
+# - low-cardinality text (type labels, system columns) is dictionary encoded as
+#   integer codes plus the distinct values
+# - other text is UTF-8 bytes plus offsets; dicts and lists are stored as JSON text
+# Nothing is pickled, and np.load reads each array only when it is accessed.
+
+# Function to pick the narrowest integer type for dictionary codes
+def code_dtype(n_categories):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+# Text is kept as one UTF-8 buffer with character offsets, so reading decodes once and slices
+def encode_strings(values):
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in values], out=offsets[1:])
+    return np.frombuffer(''.join(values).encode('utf-8'), dtype=np.uint8), offsets
+
+def decode_strings(data, offsets):
+    text = data.tobytes().decode('utf-8')
+    bounds = offsets.tolist()
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+# Function to write a DataFrame as a columnar archive. Text columns whose distinct
+# values make up at most `category_ratio` of the rows are dictionary encoded.
+def write_columnar(df, path, category_ratio=0.5):
+    arrays = {}
+    schema = {'rows': len(df), 'columns': []}
+    for name in df.columns:
+        series = df[name]
+        column = {'name': name}
+        if is_numeric_dtype(series) and not is_bool_dtype(series):
+            if is_integer_dtype(series):
+                series = pd.to_numeric(series, downcast='integer')
+            arrays[f'{name}.values'] = series.to_numpy()
+            column['kind'] = 'numeric'
+        else:
+            is_json = any(isinstance(value, (dict, list)) for value in series)
+            if is_json:
+                series = series.map(lambda value: value if value is None else json.dumps(value, ensure_ascii=False))
+            codes, categories = pd.factorize(series)
+            if len(categories) <= category_ratio * len(series):
+                arrays[f'{name}.codes'] = codes.astype(code_dtype(len(categories)))
+                arrays[f'{name}.categories'] = np.array([str(value) for value in categories], dtype=str)
+                column['kind'] = 'category'
+            else:
+                nulls = series.isna().to_numpy()
+                values = ['' if null else str(value) for value, null in zip(series, nulls)]
+                arrays[f'{name}.data'], arrays[f'{name}.offsets'] = encode_strings(values)
+                if nulls.any():
+                    arrays[f'{name}.nulls'] = nulls
+                column['kind'] = 'text'
+            column['json'] = bool(is_json)
+        schema['columns'].append(column)
+    arrays[SCHEMA_KEY] = np.frombuffer(json.dumps(schema).encode('utf-8'), dtype=np.uint8)
+    np.savez_compressed(path, **arrays)
+
+# Reader for archives written by write_columnar; columns are decoded on demand
+class ColumnarFile:
+    def __init__(self, path):
+        self.archive = np.load(path, allow_pickle=False)
+        self.schema = json.loads(self.archive[SCHEMA_KEY].tobytes())
+        self.kinds = {column['name']: column for column in self.schema['columns']}
+        self.columns = [column['name'] for column in self.schema['columns']]
+
+    def __len__(self):
+        return self.schema['rows']
+
+    def column(self, name):
+        column = self.kinds[name]
+        if column['kind'] == 'numeric':
+            return pd.Series(self.archive[f'{name}.values'], name=name)
+        if column['kind'] == 'category':
+            categories = self.archive[f'{name}.categories'].tolist()
+            values = pd.Categorical.from_codes(self.archive[f'{name}.codes'], categories=categories)
+            series = pd.Series(values, name=name)
+        else:
+            series = pd.Series(decode_strings(self.archive[f'{name}.data'], self.archive[f'{name}.offsets']),
+                               name=name, dtype=object)
+            if f'{name}.nulls' in self.archive:
+                series[self.archive[f'{name}.nulls']] = None
+        if column['json']:
+            series = series.map(lambda value: value if value is None else json.loads(value)).astype(object)
+        return series
+
+    def read(self, columns=None):
+        names = columns or self.columns
+        return pd.DataFrame({name: self.column(name) for name in names}, columns=names)
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Function to load some or all columns of a columnar archive into a DataFrame
+def read_columnar(path, columns=None):
+    with ColumnarFile(path) as columnar_file:
+        return columnar_file.read(columns)
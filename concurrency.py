@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import threading
+from metrics import registry
+
+CONCURRENCY_LIMIT = registry.gauge('scraper_concurrency_limit', 'Adaptive limit on profiles in flight')
+CONCURRENCY_IN_FLIGHT = registry.gauge('scraper_concurrency_in_flight', 'Profiles in flight under the adaptive limit')
+
+# Additive-increase / multiplicative-decrease limit on in-flight work.
+# Request outcomes are fed in through record(); every `window` samples the limit
+# grows by `increase` if the window was healthy, or is multiplied by
+# `decrease_factor` if it saw a 429, too many errors or latency well above the
+# best window seen so far (`latency_slack` seconds of headroom keep very fast
+# windows from being judged on noise).
+class AIMDController:
+    def __init__(self, initial_limit, min_limit, max_limit, window=20, increase=1,
+                 decrease_factor=0.5, max_error_rate=0.1, latency_tolerance=2.0,
+                 latency_slack=0.05):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(max(initial_limit, self.min_limit), self.max_limit)
+        self.window = window
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.max_error_rate = max_error_rate
+        self.latency_tolerance = latency_tolerance
+        self.latency_slack = latency_slack
+        self.in_flight = 0
+        self.best_latency = None
+        self.samples = []
+        self.increases = 0
+        self.decreases = 0
+        self.last_decision = None
+        self.condition = threading.Condition()
+        self.async_condition = None
+        self.async_loop = None
+        CONCURRENCY_LIMIT.track(lambda: self.limit)
+        CONCURRENCY_IN_FLIGHT.track(lambda: self.in_flight)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config.get('max_workers', 10),
+            config.get('adaptive_min_workers', 2),
+            config.get('adaptive_max_workers', 50),
+            config.get('adaptive_window', 20),
+            config.get('adaptive_increase', 1),
+            config.get('adaptive_decrease_factor', 0.5),
+            config.get('adaptive_max_error_rate', 0.1),
+            config.get('adaptive_latency_tolerance', 2.0)
+        )
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    # Async variants of acquire/release; all callers must share one event loop (a
+    # new loop, e.g. from another asyncio.run, gets a new condition)
+    async def acquire_async(self):
+        if self.async_loop is not asyncio.get_running_loop():
+            self.async_loop = asyncio.get_running_loop()
+            self.async_condition = asyncio.Condition()
+        async with self.async_condition:
+            await self.async_condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release_async(self):
+        async with self.async_condition:
+            self.in_flight -= 1
+            self.async_condition.notify_all()
+
+    async def _notify_async(self, condition):
+        async with condition:
+            condition.notify_all()
+
+    # Function to wake the coroutines waiting in acquire_async after the limit was
+    # raised; safe to call from any thread
+    def _wake_async(self):
+        loop, condition = self.async_loop, self.async_condition
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(lambda: loop.create_task(self._notify_async(condition)))
+        except RuntimeError:  # the loop closed in the meantime
+            pass
+
+    # Record one request: latency in seconds and HTTP status (None for a network error)
+    def record(self, latency, status):
+        with self.condition:
+            self.samples.append((latency, status))
+            if len(self.samples) < self.window:
+                return
+            old_limit = self.limit
+            self._adjust()
+            raised = self.limit > old_limit
+            self.condition.notify_all()
+        if raised:
+            self._wake_async()
+
+    def _adjust(self):
+        samples, self.samples = self.samples, []
+        throttled = sum(1 for _, status in samples if status == 429)
+        errors = sum(1 for _, status in samples if status is None or status >= 500)
+        error_rate = errors / len(samples)
+        mean_latency = sum(latency for latency, _ in samples) / len(samples)
+        if self.best_latency is None or mean_latency < self.best_latency:
+            self.best_latency = mean_latency
+
+        old_limit = self.limit
+        if throttled:
+            reason = f"{throttled} throttled responses"
+        elif error_rate > self.max_error_rate:
+            reason = f"error rate {error_rate:.0%}"
+        elif mean_latency > self.best_latency * self.latency_tolerance + self.latency_slack:
+            reason = f"latency {mean_latency:.2f}s vs best {self.best_latency:.2f}s"
+        else:
+            reason = None
+
+        if reason:
+            self.limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+            self.decreases += 1
+            self.last_decision = f"decrease: {reason}"
+        else:
+            self.limit = min(self.max_limit, self.limit + self.increase)
+            self.increases += 1
+            self.last_decision = f"increase: latency {mean_latency:.2f}s, error rate {error_rate:.0%}"
+
+        if self.limit != old_limit:
+            logging.info(f"Concurrency limit {old_limit} -> {self.limit} ({self.last_decision})")
+
+    def stats(self):
+        with self.condition:
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'best_latency': self.best_latency,
+                'last_decision': self.last_decision
+            }
@@ -0,0 +1,223 @@
+import math
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from record_store import open_store
+
+PROFILE_COLUMNS = ['id', 'mbti_profile', 'wiki_description', 'sub_cat_id', 'cat_id', 'property_id', 'total_vote_counts']
+SYSTEM_COLUMNS = [f'system_{i}' for i in range(1, 12)]
+VOTE_COLUMNS = ['profile_id', 'system_id', 'personality_type', 'theCount']
+
+# Function to append the votes of one typing record to column lists keyed by VOTE_COLUMNS;
+# systems listed without votes go to `empty_systems` as (profile_id, system_id) if given
+def flatten_votes(profile_id, typing_data, columns, empty_systems=None):
+    for system_id, votes in typing_data.get('breakdown_systems', {}).items():
+        if not votes and empty_systems is not None:
+            empty_systems.append((profile_id, system_id))
+        for vote in votes:
+            columns['profile_id'].append(profile_id)
+            columns['system_id'].append(system_id)
+            columns['personality_type'].append(vote['personality_type'])
+            columns['theCount'].append(vote['theCount'])
+
+# Function to reduce column lists to compact arrays: numbers as int64 arrays, strings
+# as integer codes plus the distinct values, which pickle far smaller than dicts
+def pack_columns(columns):
+    return {
+        'profile_id': np.asarray(columns['profile_id'], dtype=np.int64),
+        'system_id': pd.factorize(pd.Series(columns['system_id'], dtype=object)),
+        'personality_type': pd.factorize(pd.Series(columns['personality_type'], dtype=object)),
+        'theCount': pd.to_numeric(pd.Series(columns['theCount'], dtype=object)).to_numpy()
+    }
+
+# Function to rebuild the long vote table from packed chunks, keeping chunk order. The
+# systems listed without votes are kept in votes.attrs['empty_systems'] for wide_view.
+def votes_frame(packed_chunks):
+    votes = {}
+    for name in VOTE_COLUMNS:
+        parts = []
+        for packed in packed_chunks:
+            if name in ('system_id', 'personality_type'):
+                codes, uniques = packed[name]
+                parts.append(np.asarray(uniques, dtype=object)[codes])
+            else:
+                parts.append(packed[name])
+        votes[name] = np.concatenate(parts) if parts else []
+    votes = pd.DataFrame(votes, columns=VOTE_COLUMNS)
+    votes['profile_id'] = votes['profile_id'].astype(np.int64)
+    votes['theCount'] = pd.to_numeric(votes['theCount'])
+    votes.attrs['empty_systems'] = [pair for packed in packed_chunks for pair in packed.get('empty_systems', ())]
+    return votes
+
+# Record store opened once per worker process (or once in-process when jobs is 1)
+worker_store = None
+
+def init_worker(config, dirs):
+    global worker_store
+    worker_store = open_store(config, dirs)
+
+# Worker: read one chunk of typing records and reduce it to packed columns
+def load_votes_chunk(profile_ids):
+    columns = {name: [] for name in VOTE_COLUMNS}
+    missing, empty_systems = [], []
+    for profile_id in profile_ids:
+        typing_data = worker_store.read('typing', profile_id)
+        if typing_data is None:
+            missing.append(profile_id)
+            continue
+        flatten_votes(profile_id, typing_data, columns, empty_systems)
+    packed = pack_columns(columns)
+    packed['empty_systems'] = empty_systems
+    return packed, missing
+
+# Worker: list the systems of each typing record in one chunk as comma separated
+# system IDs ('' where the record is missing)
+def load_systems_chunk(profile_ids):
+    systems = []
+    for profile_id in profile_ids:
+        typing_data = worker_store.read('typing', profile_id) or {}
+        systems.append(','.join(str(system_id) for system_id in typing_data.get('breakdown_systems', {})))
+    return systems
+
+# Worker: read one chunk of whole records (None where missing)
+def load_records_chunk(kind, profile_ids):
+    return [worker_store.read(kind, profile_id) for profile_id in profile_ids]
+
+# Function to start a worker pool that several load_votes/load_records calls can share
+# (a no-op context when jobs is 1)
+def open_pool(config, dirs, jobs):
+    if jobs <= 1:
+        return nullcontext()
+    return ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(config, dirs))
+
+# Function to run `func` over consecutive chunks of `profile_ids`, in `jobs` processes
+# that each open their own record store; results come back in chunk order
+def map_chunks(func, chunks, config, dirs, jobs, desc, pool=None):
+    total = sum(len(chunk) for chunk in chunks)
+    with tqdm(total=total, desc=desc, leave=pool is None) as progress:
+        if pool is not None:
+            for chunk, result in zip(chunks, pool.map(func, chunks)):
+                yield result
+                progress.update(len(chunk))
+            return
+        if jobs <= 1:
+            init_worker(config, dirs)
+            try:
+                for chunk in chunks:
+                    yield func(chunk)
+                    progress.update(len(chunk))
+            finally:
+                worker_store.close()
+            return
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(config, dirs)) as executor:
+            for chunk, result in zip(chunks, executor.map(func, chunks)):
+                yield result
+                progress.update(len(chunk))
+
+def split_ids(profile_ids, jobs, chunks_per_job=8):
+    size = max(1, math.ceil(len(profile_ids) / (max(jobs, 1) * chunks_per_job)))
+    return [profile_ids[i:i + size] for i in range(0, len(profile_ids), size)]
+
+# Function to flatten breakdown_systems of every profile into one long table:
+# one row per (profile_id, system_id, personality_type, theCount). With jobs > 1 the
+# ID list is split across a process pool; the result is the same as with jobs=1.
+def load_votes(config, dirs, profile_ids, skip_missing=False, jobs=1, pool=None):
+    packed_chunks = []
+    for packed, missing in map_chunks(load_votes_chunk, split_ids(profile_ids, jobs), config, dirs, jobs,
+                                      "Loading typing data", pool):
+        for profile_id in missing:
+            if not skip_missing:
+                raise FileNotFoundError(f"No typing data stored for profile ID {profile_id}")
+            print(f"No typing data stored for profile ID {profile_id}")
+        packed_chunks.append(packed)
+    return votes_frame(packed_chunks)
+
+# Function to read whole records of one kind in ID order, None where a record is missing
+def load_records(config, dirs, kind, profile_ids, jobs=1, pool=None):
+    records = []
+    for chunk_records in map_chunks(partial(load_records_chunk, kind), split_ids(profile_ids, jobs), config, dirs,
+                                    jobs, f"Loading {kind} data", pool):
+        records.extend(chunk_records)
+    return records
+
+# Function to list the systems of each profile's typing record, as load_systems_chunk
+# does, in ID order
+def load_systems(config, dirs, profile_ids, jobs=1, pool=None):
+    systems = []
+    for chunk_systems in map_chunks(load_systems_chunk, split_ids(profile_ids, jobs), config, dirs, jobs,
+                                    "Listing typing systems", pool):
+        systems.extend(chunk_systems)
+    return systems
+
+# Function to turn the per-profile lists of load_systems into the set of system columns
+# at least one profile has
+def system_columns(profile_systems):
+    return {f'system_{system_id}' for systems in profile_systems for system_id in systems.split(',') if system_id}
+
+# Function to read the vote table from the typing tables main.py maintains in SQLite instead
+# of the record store. With top_only it reads the precomputed top vote per profile and system,
+# which is all the wide layout needs.
+def load_votes_from_db(db_path, profile_ids, top_only=False, batch_size=900):
+    if top_only:
+        query = '''
+            SELECT profile_id, CAST(system_id AS TEXT), personality_type, theCount FROM typing_top_votes
+            WHERE profile_id IN ({}) ORDER BY profile_id, system_id
+        '''
+    else:
+        query = '''
+            SELECT profile_id, CAST(system_id AS TEXT), personality_type, theCount FROM typing_votes
+            WHERE profile_id IN ({}) ORDER BY profile_id, position
+        '''
+    columns = {name: [] for name in VOTE_COLUMNS}
+    conn = sqlite3.connect(db_path)
+    try:
+        for start in tqdm(range(0, len(profile_ids), batch_size), desc="Loading typing votes"):
+            batch = profile_ids[start:start + batch_size]
+            for row in conn.execute(query.format(','.join('?' * len(batch))), batch):
+                for name, value in zip(VOTE_COLUMNS, row):
+                    columns[name].append(value)
+    finally:
+        conn.close()
+    return votes_frame([pack_columns(columns)])
+
+# Function to keep the highest voted row per (profile, system); like max(), ties go to the first vote listed
+def top_votes(votes):
+    if votes.empty:
+        return votes
+    return votes.loc[votes.groupby(['profile_id', 'system_id'], sort=False)['theCount'].idxmax()]
+
+# Wide layout: one row per profile with its top personality type in system_1..system_11.
+# As the exporters have always written it, a system listed without votes is '', a
+# system no profile has is '' and a system only other profiles have is missing (NaN,
+# null in JSON and empty in CSV). `systems` is the set of system columns some profile
+# of the whole export has; it defaults to those in `votes`, so exports built a part at
+# a time (chunks, incremental updates) must pass it to match a full export.
+def wide_view(profiles_df, votes, systems=None):
+    top = top_votes(votes)
+    types = top.pivot(index='profile_id', columns='system_id', values='personality_type')
+    types.columns = [f'system_{system_id}' for system_id in types.columns]
+    types = types.reindex(columns=SYSTEM_COLUMNS).astype(object)
+    combined_df = profiles_df.merge(types, how='left', left_on='id', right_index=True)
+    empty = pd.DataFrame(votes.attrs.get('empty_systems', []), columns=['profile_id', 'system_id'])
+    empty = empty[empty['profile_id'].isin(combined_df['id'])]
+    empty_columns = empty['system_id'].map(lambda system_id: f'system_{system_id}')
+    if systems is None:
+        systems = set(top['system_id'].map(lambda system_id: f'system_{system_id}')) | set(empty_columns)
+    for column in SYSTEM_COLUMNS:
+        if column not in systems:
+            combined_df[column] = ''
+            continue
+        empty_ids = empty.loc[empty_columns == column, 'profile_id']
+        if len(empty_ids):
+            combined_df.loc[combined_df['id'].isin(empty_ids) & combined_df[column].isna(), column] = ''
+    return combined_df[PROFILE_COLUMNS + SYSTEM_COLUMNS].reset_index(drop=True)
+
+# Long layout: one row per vote joined to its profile
+def long_view(profiles_df, votes):
+    combined_df = profiles_df.merge(votes, how='inner', left_on='id', right_on='profile_id')
+    combined_df = combined_df.rename(columns={'theCount': 'vote_count'})
+    return combined_df[PROFILE_COLUMNS + ['system_id', 'personality_type', 'vote_count']]
@@ -0,0 +1,115 @@
+import io
+import os
+from functools import partial
+import pandas as pd
+from columnar import read_columnar, write_columnar
+from export_engine import load_systems, system_columns
+from record_store import open_store
+
+# Incremental exports keep a manifest next to the output ({output}.manifest.npz):
+# one row per exported profile with a hash of its profile row and the store's
+# change token for each record kind it was built from. The next run rebuilds only
+# profiles that are new or whose row or records changed, drops profiles that are
+# gone, and patches the previous output. Rows keep the order of the profiles
+# table, so the result is the same file a full export would write. Wide exports also
+# keep each profile's typing systems in the manifest, since whether a system column
+# is '' or missing depends on every profile; when that set of columns changes, every
+# profile is rebuilt.
+INCREMENTAL_FORMATS = ('csv', 'npz')
+
+def manifest_path(output_path):
+    return f'{output_path}.manifest.npz'
+
+# Function to fingerprint every profile: a hash of its row plus each record's change token
+def build_manifest(profiles_df, config, dirs, kinds):
+    manifest = pd.DataFrame({
+        'id': profiles_df['id'].to_numpy(),
+        'row_hash': pd.util.hash_pandas_object(profiles_df, index=False).to_numpy()
+    })
+    store = open_store(config, dirs)
+    try:
+        for kind in kinds:
+            versions = store.versions(kind)
+            manifest[kind] = [versions.get(profile_id, '') for profile_id in manifest['id'].tolist()]
+    finally:
+        store.close()
+    return manifest
+
+# Function to list the IDs whose fingerprint differs from (or is missing in) the previous manifest
+def changed_ids(manifest, previous):
+    columns = list(manifest.columns)
+    if previous is None or list(previous.columns) != columns:
+        return set(manifest['id'].tolist())
+    previous = previous.astype({column: manifest[column].dtype for column in columns})
+    merged = manifest.merge(previous, on='id', how='left', suffixes=('', '_previous'), indicator=True)
+    changed = merged['_merge'] == 'left_only'
+    for column in columns[1:]:
+        changed |= merged[column] != merged[f'{column}_previous']
+    return set(merged.loc[changed, 'id'].tolist())
+
+# Previous output as written: CSV cells are kept as text so unchanged rows are copied verbatim
+def read_output(output_path, output_format):
+    if output_format == 'npz':
+        return read_columnar(output_path)
+    return pd.read_csv(output_path, dtype=str, keep_default_na=False)
+
+def as_output_rows(combined_df, output_format):
+    if output_format == 'npz':
+        return combined_df
+    return pd.read_csv(io.StringIO(combined_df.to_csv(index=False)), dtype=str, keep_default_na=False)
+
+# Write to a temporary file first so a failed run leaves the previous output intact
+def write_output(combined_df, output_path, output_format):
+    if output_format == 'npz':
+        temp_path = f'{output_path}.tmp.npz'
+        write_columnar(combined_df, temp_path)
+    else:
+        temp_path = f'{output_path}.tmp'
+        combined_df.to_csv(temp_path, index=False)
+    os.replace(temp_path, output_path)
+
+# Function to export `profiles_df` through `build` (profiles -> output rows keyed by 'id'),
+# rebuilding only the profiles whose row or `kinds` records changed since the last run.
+# With track_systems, `build` is also passed `systems`, the system columns some profile has.
+def export_incremental(profiles_df, build, config, dirs, kinds, output_path, output_format, track_systems=False):
+    if output_format not in INCREMENTAL_FORMATS:
+        raise ValueError(f"Incremental export writes {' or '.join(INCREMENTAL_FORMATS)}, not {output_format}")
+    manifest = build_manifest(profiles_df, config, dirs, kinds)
+    previous_output = previous_manifest = None
+    if os.path.exists(output_path) and os.path.exists(manifest_path(output_path)):
+        previous_manifest = read_columnar(manifest_path(output_path))
+        previous_output = read_output(output_path, output_format)
+    previous_systems = None
+    if previous_manifest is not None and 'systems' in previous_manifest.columns:
+        previous_systems = previous_manifest.pop('systems')
+    changed = changed_ids(manifest, previous_manifest)
+    if track_systems:
+        known = {}
+        if previous_systems is not None:
+            known = dict(zip(previous_manifest['id'].tolist(), previous_systems.astype(str).tolist()))
+        stale = [profile_id for profile_id in manifest['id'].tolist() if profile_id in changed or profile_id not in known]
+        known.update(zip(stale, load_systems(config, dirs, stale)))
+        manifest['systems'] = [known[profile_id] for profile_id in manifest['id'].tolist()]
+        systems = system_columns(manifest['systems'])
+        if previous_systems is None or systems != system_columns(previous_systems.astype(str)):
+            changed = set(manifest['id'].tolist())
+        build = partial(build, systems=systems)
+    print(f"Incremental export: {len(changed)} of {len(manifest)} profiles new or changed")
+
+    parts = []
+    if previous_output is not None:
+        # Keep unchanged rows; rows of changed or deleted profiles are replaced or dropped
+        keep = previous_output['id'].astype('int64').isin(set(manifest['id'].tolist()) - changed)
+        parts.append(previous_output[keep])
+    if changed or previous_output is None:
+        parts.append(as_output_rows(build(profiles_df[profiles_df['id'].isin(changed)]), output_format))
+    # An empty frame would change the dtypes of the others when concatenated
+    combined_df = pd.concat([part for part in parts if len(part)] or parts[-1:], ignore_index=True)
+    position = pd.Series(range(len(profiles_df)), index=profiles_df['id'].to_numpy())
+    order = combined_df['id'].astype('int64').map(position).to_numpy().argsort(kind='stable')
+    combined_df = combined_df.iloc[order].reset_index(drop=True)
+
+    write_output(combined_df, output_path, output_format)
+    write_columnar(manifest, manifest_path(output_path) + '.tmp.npz')
+    os.replace(manifest_path(output_path) + '.tmp.npz', manifest_path(output_path))
+    return combined_df
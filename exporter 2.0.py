@@ -1,102 +1,132 @@
-import os
 import json
+import argparse
 import pandas as pd
 import sqlite3
 from tqdm import tqdm
+from columnar import write_columnar
+from export_manifest import export_incremental
+from export_engine import load_votes, load_records, load_systems, open_pool, system_columns, wide_view, PROFILE_COLUMNS, \
+    SYSTEM_COLUMNS
 
-def extract_data_from_sqlite(db_path):
-    try:
-        conn = sqlite3.connect(db_path)
-        query = """
+PROFILES_QUERY = """
         SELECT id, mbti_profile, sub_cat_id, cat_id, property_id, total_vote_counts
         FROM profiles
         """
-        df = pd.read_sql_query(query, conn)
+
+def extract_data_from_sqlite(db_path):
+    try:
+        conn = sqlite3.connect(db_path)
+        df = pd.read_sql_query(PROFILES_QUERY, conn)
         conn.close()
         return df
     except Exception as e:
         print(f"Error extracting data from SQLite: {e}")
         return pd.DataFrame()
 
-def read_json_file(file_path):
+# Function to read the profiles table `chunksize` rows at a time through one cursor
+def iter_profile_chunks(db_path, chunksize, limit=None):
+    conn = sqlite3.connect(db_path)
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        return data
-    except Exception as e:
-        print(f"Error reading JSON file {file_path}: {e}")
-        return None
-
-def merge_data(profiles_df, json_folder_path, wiki_folder_path, limit=None):
-    combined_data = []
+        query, params = PROFILES_QUERY, ()
+        if limit:
+            query, params = query + "LIMIT ?", (limit,)
+        for chunk in pd.read_sql_query(query, conn, params=params, chunksize=chunksize):
+            yield chunk
+    finally:
+        conn.close()
 
+def merge_data(profiles_df, config, dirs, limit=None, jobs=1, pool=None, systems=None):
     # If limit is specified, restrict the DataFrame to the first 'limit' rows
     if limit:
         profiles_df = profiles_df.head(limit)
 
-    for index, row in tqdm(profiles_df.iterrows(), total=len(profiles_df), desc="Processing profiles"):
-        profile_id = row['id']
-        json_data = read_json_file(os.path.join(json_folder_path, f'{profile_id}_typing.json'))
+    profile_ids = profiles_df['id'].tolist()
+    votes = load_votes(config, dirs, profile_ids, skip_missing=True, jobs=jobs, pool=pool)
 
-        # Read the Wikipedia data
-        wiki_file_path = os.path.join(wiki_folder_path, f'{profile_id}_wiki.json')
-        wiki_data = read_json_file(wiki_file_path)
+    # Include the entire wiki JSON content in the 'wiki_description' column
+    wiki_descriptions = []
+    for profile_id, wiki_data in zip(profile_ids, load_records(config, dirs, 'wiki', profile_ids, jobs, pool)):
+        if not wiki_data:
+            print(f"No wiki description found for profile ID {profile_id}")
+        wiki_descriptions.append(wiki_data if wiki_data else {})
+    profiles_df = profiles_df.assign(wiki_description=wiki_descriptions)
 
-        # Include the entire wiki JSON content in the 'wiki_description' key
-        wiki_description = wiki_data if wiki_data else {}
-        if not wiki_description:
-            print(f"No wiki description found in file: {wiki_file_path}")
+    return wide_view(profiles_df, votes, systems)
 
-        profile_entry = {
-            'id': profile_id,
-            'mbti_profile': row['mbti_profile'],
-            'wiki_description': wiki_description,  # Store entire JSON content here
-            'sub_cat_id': row['sub_cat_id'],
-            'cat_id': row['cat_id'],
-            'property_id': row['property_id'],
-            'total_vote_counts': row['total_vote_counts']
-        }
+# Function to write (first chunk) or append one chunk of rows as CSV or JSON Lines
+def save_chunk(combined_df, output_path, output_format, first):
+    mode = 'w' if first else 'a'
+    if output_format == 'csv':
+        combined_df.to_csv(output_path, mode=mode, header=first, index=False)
+    elif output_format == 'jsonl':
+        lines = combined_df.to_json(orient='records', lines=True) if len(combined_df) else ''
+        with open(output_path, mode, encoding='utf-8') as f:
+            f.write(lines if not lines or lines.endswith('\n') else lines + '\n')
 
-        breakdown_systems = json_data.get('breakdown_systems', {})
-        for system_id, votes in breakdown_systems.items():
-            if votes:
-                highest_vote = max(votes, key=lambda x: x['theCount'])
-                profile_entry[f'system_{system_id}'] = highest_vote['personality_type']
-            else:
-                profile_entry[f'system_{system_id}'] = ''
-        
-        combined_data.append(profile_entry)
+# Streaming export: profiles are read, enriched and written `chunksize` rows at a time,
+# so memory is bounded by the chunk size rather than the dataset. The system columns
+# present in any profile are listed first, so every chunk is written as in a full export.
+def export_in_chunks(db_path, dirs, output_path, output_format, limit, config, jobs, chunksize):
+    if output_format not in ('csv', 'jsonl'):
+        raise ValueError("Chunked export writes csv or jsonl; indented json needs the whole dataset in memory")
+    first = True
+    with open_pool(config, dirs, jobs) as pool:
+        profile_ids = [profile_id for profiles_df in iter_profile_chunks(db_path, chunksize, limit)
+                       for profile_id in profiles_df['id'].tolist()]
+        systems = system_columns(load_systems(config, dirs, profile_ids, jobs, pool))
+        with tqdm(desc="Exporting profiles", unit=" profiles") as progress:
+            for profiles_df in iter_profile_chunks(db_path, chunksize, limit):
+                combined_df = merge_data(profiles_df, config, dirs, jobs=jobs, pool=pool, systems=systems)
+                save_chunk(combined_df, output_path, output_format, first)
+                first = False
+                progress.update(len(profiles_df))
+    if first:
+        save_chunk(pd.DataFrame(columns=PROFILE_COLUMNS + SYSTEM_COLUMNS), output_path, output_format, True)
 
-    combined_df = pd.DataFrame(combined_data)
-    return combined_df
+def main(db_path, json_folder_path, wiki_folder_path, output_path, output_format='json', limit=None, config=None,
+         jobs=1, chunksize=None, incremental=False):
+    dirs = {'typing': json_folder_path, 'wiki': wiki_folder_path}
+    if chunksize:
+        export_in_chunks(db_path, dirs, output_path, output_format, limit, config or {}, jobs, chunksize)
+        print(f"Combined data saved to {output_path} as {output_format.upper()}")
+        return
 
-def main(db_path, json_folder_path, wiki_folder_path, output_path, output_format='json', limit=None):
     profiles_df = extract_data_from_sqlite(db_path)
-    combined_df = merge_data(profiles_df, json_folder_path, wiki_folder_path, limit)
-    
-    # Ensure all system columns are present (up to system_11)
-    for i in range(1, 12):
-        if f'system_{i}' not in combined_df.columns:
-            combined_df[f'system_{i}'] = ''
-    
-    # Reorder columns
-    column_order = ['id', 'mbti_profile', 'wiki_description', 'sub_cat_id', 'cat_id', 'property_id', 'total_vote_counts'] + \
-                   [f'system_{i}' for i in range(1, 12)]
-    combined_df = combined_df[column_order]
+    if incremental:
+        export_incremental(profiles_df.head(limit) if limit else profiles_df,
+                           lambda df, systems: merge_data(df, config or {}, dirs, jobs=jobs, systems=systems),
+                           config or {}, dirs, ['typing', 'wiki'], output_path, output_format, track_systems=True)
+        print(f"Combined data saved to {output_path} as {output_format.upper()}")
+        return
+    combined_df = merge_data(profiles_df, config or {}, dirs, limit, jobs)
 
     # Save combined data in the chosen format
     if output_format == 'json':
         combined_df.to_json(output_path, orient='records', indent=4)
-    elif output_format == 'csv':
-        combined_df.to_csv(output_path, index=False)
+    elif output_format in ('csv', 'jsonl'):
+        save_chunk(combined_df, output_path, output_format, True)
+    elif output_format == 'npz':
+        write_columnar(combined_df, output_path)
     print(f"Combined data saved to {output_path} as {output_format.upper()}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=1, help="Worker processes used to load typing and wiki data")
+    parser.add_argument('--output_format', choices=['json', 'csv', 'jsonl', 'npz'], default='json')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="Stream profiles in chunks of this many rows (csv or jsonl only)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Rebuild only new or changed profiles and patch the previous output")
+    args = parser.parse_args()
+
     db_path = 'personality_profiles.db'
     json_folder_path = 'C:/Users/abdel/Desktop/Nyx/data/typing/'
     wiki_folder_path = 'C:/Users/abdel/Desktop/Nyx/data/wiki/'
-    output_path = 'combined_data_full_wiki.json'
-    output_format = 'json'
+    output_format = args.output_format
+    output_path = f'combined_data_full_wiki.{output_format}'
     limit = None  # Set your desired limit here
+    with open('config.json') as f:
+        config = json.load(f)
 
-    main(db_path, json_folder_path, wiki_folder_path, output_path, output_format, limit)
+    main(db_path, json_folder_path, wiki_folder_path, output_path, output_format, limit, config, args.jobs,
+         args.chunksize, args.incremental)
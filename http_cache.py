@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from metrics import registry
+from persistence import connect
+
+CACHE_REQUESTS = registry.counter('scraper_http_cache_requests_total', 'Cache lookups by result', ('result',))
+CACHE_BYTES = registry.gauge('scraper_http_cache_bytes', 'Compressed size of the cached responses')
+
+# On-disk cache of API responses keyed by URL, shared by main.py and wikipedia.py.
+# Bodies of 200 responses are stored zlib-compressed in SQLite with the ETag and
+# Last-Modified headers they came with:
+# - an entry younger than `ttl` seconds is served without a request
+# - an older one is revalidated with If-None-Match / If-Modified-Since; a 304
+#   serves the stored body and makes the entry fresh again. Callers polling for
+#   changes (e.g. the newest comments) ask for revalidation whatever the age.
+# - once the bodies exceed `max_bytes`, the least recently used entries are evicted;
+#   access times are kept in memory and written in batches of `access_batch_size`
+# - in offline mode every entry is served regardless of age and a URL that is not
+#   cached raises CacheMiss instead of being requested
+CACHE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS responses (
+        url TEXT PRIMARY KEY,
+        body BLOB,
+        size INTEGER,
+        etag TEXT,
+        last_modified TEXT,
+        stored_at REAL,
+        accessed_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at);
+'''
+
+class CacheMiss(Exception):
+    pass
+
+class ResponseCache:
+    def __init__(self, path, ttl=86400, max_bytes=1073741824, offline=False, access_batch_size=500):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.access_batch_size = access_batch_size
+        self.accessed = {}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = connect(path)
+        self.conn.executescript(CACHE_TABLE)
+        self.lock = threading.Lock()
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        self.hits = self.revalidated = self.misses = 0
+        CACHE_REQUESTS.track(lambda: {('hit',): self.hits, ('revalidated',): self.revalidated, ('miss',): self.misses})
+        CACHE_BYTES.track(lambda: self.total_bytes)
+        self._evict()
+        self.conn.commit()
+
+    @classmethod
+    def from_config(cls, config):
+        if not config.get('http_cache', False) and not config.get('http_cache_offline', False):
+            return None
+        return cls(
+            config.get('http_cache_path', 'data/http_cache.db'),
+            config.get('http_cache_ttl', 86400),
+            config.get('http_cache_max_bytes', 1073741824),
+            config.get('http_cache_offline', False)
+        )
+
+    # Stored entry for `url` as a dict (body decompressed), or None
+    def lookup(self, url):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT body, etag, last_modified, stored_at FROM responses WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            self.accessed[url] = time.time()
+            if len(self.accessed) >= self.access_batch_size:
+                self._write_accessed()
+                self.conn.commit()
+        body, etag, last_modified, stored_at = row
+        return {
+            'body': zlib.decompress(body),
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh': time.time() - stored_at < self.ttl
+        }
+
+    # Function to write the access times collected by lookup (caller holds the lock and commits)
+    def _write_accessed(self):
+        accessed, self.accessed = self.accessed, {}
+        self.conn.executemany('UPDATE responses SET accessed_at = ? WHERE url = ?',
+                              [(accessed_at, url) for url, accessed_at in accessed.items()])
+
+    # Conditional request headers for revalidating a stale entry
+    @staticmethod
+    def validators(entry):
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, body, headers):
+        data = zlib.compress(body)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self.conn.execute('''
+                INSERT OR REPLACE INTO responses (url, body, size, etag, last_modified, stored_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (url, data, len(data), headers.get('ETag'), headers.get('Last-Modified'), now, now))
+            self.total_bytes += len(data) - (row[0] if row else 0)
+            self.accessed.pop(url, None)
+            self._write_accessed()
+            self._evict()
+            self.conn.commit()
+
+    # Function to mark an entry fresh again after a 304, keeping any new validators
+    def refresh(self, url, headers):
+        with self.lock:
+            self.conn.execute('''
+                UPDATE responses SET stored_at = ?, etag = COALESCE(?, etag),
+                    last_modified = COALESCE(?, last_modified)
+                WHERE url = ?
+            ''', (time.time(), headers.get('ETag'), headers.get('Last-Modified'), url))
+            self.conn.commit()
+
+    # Drop least recently used entries until the bodies take at most 90% of max_bytes
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute('SELECT url, size FROM responses ORDER BY accessed_at')
+        evicted = []
+        for url, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((url,))
+            self.total_bytes -= size
+        self.conn.executemany('DELETE FROM responses WHERE url = ?', evicted)
+        logging.debug(f"HTTP cache: evicted {len(evicted)} least recently used responses")
+
+    # Function to handle the response to a cache miss or revalidation
+    def save_response(self, url, entry, status, body, headers, decode):
+        if status == 304 and entry is not None:
+            self.revalidated += 1
+            self.refresh(url, headers)
+            return 200, decode(entry['body'])
+        self.misses += 1
+        if status != 200:
+            return status, None
+        payload = decode(body)
+        self.store(url, body, headers)
+        return status, payload
+
+    def stats(self):
+        return {'hits': self.hits, 'revalidated': self.revalidated, 'misses': self.misses,
+                'bytes': self.total_bytes}
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM responses')
+            self.conn.commit()
+            self.total_bytes = 0
+
+    def close(self):
+        with self.lock:
+            self._write_accessed()
+            self.conn.commit()
+        self.conn.close()
+
+# Function to serve `url` from the cache when possible. `send(headers)` performs the
+# request with the given extra headers and returns (status, body bytes, response
+# headers); it is only called when the entry is missing or stale, or with `revalidate`
+# whenever the API can be asked. Returns (status, payload): the body passed through
+# `decode` for a 200, else None. Bodies that fail to decode raise before they are stored.
+def cached_get(cache, url, send, decode=json.loads, revalidate=False):
+    if cache is None:
+        status, body, _ = send({})
+        return status, decode(body) if status == 200 else None
+    entry = cache.lookup(url)
+    if entry is not None and ((entry['fresh'] and not revalidate) or cache.offline):
+        cache.hits += 1
+        return 200, decode(entry['body'])
+    if cache.offline:
+        raise CacheMiss(f"{url} is not cached (offline mode)")
+    status, body, headers = send(cache.validators(entry))
+    return cache.save_response(url, entry, status, body, headers, decode)
+
+# Async variant of cached_get; `send` is a coroutine function. The SQLite work runs in
+# the default executor so it never blocks the event loop.
+async def cached_get_async(cache, url, send, decode=json.loads, revalidate=False):
+    if cache is None:
+        status, body, _ = await send({})
+        return status, decode(body) if status == 200 else None
+    loop = asyncio.get_running_loop()
+    entry = await loop.run_in_executor(None, cache.lookup, url)
+    if entry is not None and ((entry['fresh'] and not revalidate) or cache.offline):
+        cache.hits += 1
+        return 200, decode(entry['body'])
+    if cache.offline:
+        raise CacheMiss(f"{url} is not cached (offline mode)")
+    status, body, headers = await send(cache.validators(entry))
+    return await loop.run_in_executor(None, cache.save_response, url, entry, status, body, headers, decode)
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the HTTP response cache")
+    parser.add_argument('command', choices=['stats', 'clear'])
+    parser.add_argument('--path', help="Cache database (default: http_cache_path from config.json)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with open('config.json') as f:
+        config = json.load(f)
+    cache = ResponseCache(args.path or config.get('http_cache_path', 'data/http_cache.db'))
+    try:
+        if args.command == 'clear':
+            cache.clear()
+            logging.info("HTTP cache cleared")
+        else:
+            count = cache.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            print(f"{count} responses, {cache.total_bytes} bytes compressed")
+    finally:
+        cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import logging
+from id_set import IdBitmap
+
+# Profile IDs the API answered with a 404; they are never scheduled again
+MISSING_TABLE = '''
+    CREATE TABLE IF NOT EXISTS missing_profiles (
+        id INTEGER PRIMARY KEY,
+        checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# Scheduler for sparse ID spaces. The IDs from start_id up to `frontier` IDs past the
+# highest ID found so far are split into blocks of `block_size`. Every ID that was
+# processed counts as a hit and every confirmed-missing ID as a miss, which gives
+# each block a density. A plan then takes, in order:
+# 1. every remaining ID of dense blocks (density >= dense_threshold), densest first
+# 2. `min_samples` evenly spread probes of blocks with too few outcomes to judge
+# 3. every `sparse_stride`-th remaining ID of sparse blocks, densest first
+# Running plans in rounds lets the outcomes of one round steer the next: a sparse
+# block whose probes hit becomes dense and is filled in. An ID is planned at most
+# once per planner, so IDs that keep failing are not retried round after round.
+class IdSpacePlanner:
+    def __init__(self, present, settled, block_size=1000, min_samples=10, dense_threshold=0.1,
+                 sparse_stride=20, frontier=100000):
+        self.present = present
+        self.settled = settled
+        self.block_size = block_size
+        self.min_samples = min_samples
+        self.dense_threshold = dense_threshold
+        self.sparse_stride = sparse_stride
+        self.frontier = frontier
+        self.planned = IdBitmap()
+
+    @classmethod
+    def from_config(cls, config, present, settled):
+        return cls(
+            present,
+            settled,
+            config.get('discovery_block_size', 1000),
+            config.get('discovery_min_samples', 10),
+            config.get('discovery_dense_threshold', 0.1),
+            config.get('discovery_sparse_stride', 20),
+            config.get('discovery_frontier', 100000)
+        )
+
+    # IDs of [start, end) without an outcome yet that were not planned before
+    def unsettled(self, start, end):
+        return [id_ for id_ in self.settled.missing(start, end - start) if id_ < end and id_ not in self.planned]
+
+    # Function to choose up to `limit` IDs to request next, starting at start_id
+    def plan(self, start_id, limit):
+        end_id = max(self.present.max() or 0, start_id) + self.frontier
+        dense, unexplored, sparse = [], [], []
+        for block_start in range(start_id, end_id, self.block_size):
+            block_end = block_start + self.block_size
+            hits = self.present.count_range(block_start, block_end)
+            outcomes = self.settled.count_range(block_start, block_end)
+            if outcomes == self.block_size:
+                continue
+            if outcomes < self.min_samples:
+                unexplored.append((block_start, block_end, self.min_samples - outcomes))
+            elif hits / outcomes >= self.dense_threshold:
+                dense.append((hits / outcomes, block_start, block_end))
+            else:
+                sparse.append((hits / outcomes, block_start, block_end))
+
+        profile_ids = []
+        for _, block_start, block_end in sorted(dense, key=lambda block: (-block[0], block[1])):
+            profile_ids.extend(self.unsettled(block_start, block_end)[:limit - len(profile_ids)])
+            if len(profile_ids) >= limit:
+                break
+        for block_start, block_end, needed in unexplored:
+            if len(profile_ids) >= limit:
+                break
+            candidates = self.unsettled(block_start, block_end)
+            stride = max(len(candidates) // needed, 1)
+            profile_ids.extend(candidates[::stride][:min(needed, limit - len(profile_ids))])
+        for _, block_start, block_end in sorted(sparse, key=lambda block: (-block[0], block[1])):
+            if len(profile_ids) >= limit:
+                break
+            candidates = self.unsettled(block_start, block_end)[::self.sparse_stride]
+            profile_ids.extend(candidates[:limit - len(profile_ids)])
+
+        logging.info(f"ID discovery: {len(dense)} dense, {len(sparse)} sparse and {len(unexplored)} unexplored "
+                     f"blocks up to ID {end_id}; {len(profile_ids)} IDs scheduled")
+        for profile_id in profile_ids:
+            self.planned.add(profile_id)
+        return sorted(profile_ids)
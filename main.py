@@ -1,11 +1,27 @@
-import sqlite3
 import requests
+import asyncio
+import aiohttp
 import json
 import logging
-from pathlib import Path
+import os
+import socket
 from tqdm import tqdm
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from rate_limiter import RateLimiter
+from concurrency import AIMDController
+from persistence import Database, connect
+from id_set import IdBitmap
+from pipeline import Pipeline, Stage
+from record_store import open_store
+from typing_tables import TYPING_TABLES, save_typing_votes
+from search_index import SEARCH_TABLES, index_comments
+from http_cache import CacheMiss, ResponseCache, cached_get, cached_get_async
+from proxy_manager import ProxyManager, is_proxy_failure
+from id_discovery import MISSING_TABLE, IdSpacePlanner
+from metrics import MetricsExporter, observe_request, registry
+from shard_leases import LeaseKeeper, open_lease_store
+from retry_queue import RETRY_TABLES, RetryQueue, classify_status
 
 # Load configuration from file
 with open('config.json') as f:
@@ -15,30 +31,89 @@ with open('config.json') as f:
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # API endpoints and other constants
-API_URL_PROFILE = "https://api.personality-database.com/api/v1/profile/{}"
-API_URL_COMMENTS = "https://api.personality-database.com/api/v1/comments/{}?sort=HOT&offset={}&range=all&version=W3"
+API_BASE_URL = config.get('api_base_url', 'https://api.personality-database.com').rstrip('/')
+API_URL_PROFILE = API_BASE_URL + "/api/v1/profile/{}"
+API_URL_COMMENTS = API_BASE_URL + "/api/v1/comments/{}?sort=HOT&offset={}&range=all&version=W3"
+API_URL_COMMENTS_NEWEST = API_BASE_URL + "/api/v1/comments/{}?sort=NEW&offset={}&range=all&version=W3"
 TYPING_DATA_DIR = 'data/typing'
 COMMENTS_DATA_DIR = 'data/comments'
 DB_FILE = 'personality_profiles.db'
+COMMENT_ID_FIELD = config.get('comment_id_field', 'id')
+COMMENT_TIMESTAMP_FIELD = config.get('comment_timestamp_field', 'create_date')
+COMMENT_TEXT_FIELD = config.get('comment_text_field', 'comment')
+PROXY_RETRIES = config.get('proxy_retries', 2)
 
-# Function to get a proxy from the proxy pool
+# Typing and comments records go through the storage backend selected in config.json. Sharded
+# workers with a local lease table share data/, and a segment store takes only one writer process.
+if config.get('sharded', False) and not config.get('coordinator_url') and config.get('storage_backend', 'json') == 'segments':
+    raise ValueError("Sharded workers sharing data/ need the json storage backend; a segment store takes one writer process")
+store = open_store(config, {'typing': TYPING_DATA_DIR, 'comments': COMMENTS_DATA_DIR})
+
+# Shared limiter applied to every outgoing request, replacing per-worker sleeps
+rate_limiter = RateLimiter.from_config(config)
+
+# On-disk cache of API responses (None unless http_cache or http_cache_offline is set)
+response_cache = ResponseCache.from_config(config)
+
+PROFILES = registry.counter('scraper_profiles_total', 'Profiles by outcome', ('outcome',))
+COMMENT_PAGES = registry.histogram('scraper_comment_pages', 'Comments pages fetched per profile',
+                                   buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+# Metrics endpoint / file (None unless metrics_port or metrics_file is set)
+metrics_exporter = MetricsExporter.from_config(config)
+
+# Adaptive limit on profiles in flight, fed by fetch_data/fetch_comments outcomes
+concurrency_controller = AIMDController.from_config(config) if config.get('adaptive_concurrency', False) else None
+
+# Function to report an API response (status None on network error) to the rate
+# limiter, the concurrency controller, the proxy manager and the metrics
+def record_response(started, status, headers=None, proxy=None, url=None, size=0):
+    if url:
+        observe_request(url, time.monotonic() - started, status, size)
+    if status is not None:
+        rate_limiter.record_response(status, headers)
+    if concurrency_controller:
+        concurrency_controller.record(time.monotonic() - started, status)
+    if proxy_manager and proxy:
+        proxy_manager.record(proxy, time.monotonic() - started, status)
+
+# Function to get one proxy address from the proxy pool service
+def fetch_pool_proxy():
+    proxy_pool_url = config.get('proxy_pool_url')  # Get the proxy URL from the config
+    try:
+        rate_limiter.wait(proxy_pool_url)
+        response = requests.get(proxy_pool_url, timeout=config.get('proxy_request_timeout', 30))
+        rate_limiter.record_response(response.status_code, response.headers)
+        if response.status_code == 200:
+            return response.json().get('proxy')
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Failed to fetch proxy: {str(e)}")
+    return None
+
+# Proxies from the pool are prefetched in the background, reused and scored
+proxy_manager = ProxyManager.from_config(config, fetch_pool_proxy) if config.get('proxy_enabled', False) and config.get('use_proxy_pool', False) else None
+
+# Function to get a proxy from the proxy pool. With the proxy manager this only waits
+# until a healthy proxy is available; each request then picks its own proxy.
 def get_proxy():
-    if not config.get('proxy_enabled', False):
-        return None
-    if config.get('use_proxy_pool', False):
-        proxy_pool_url = config.get('proxy_pool_url')  # Get the proxy URL from the config
-        try:
-            response = requests.get(proxy_pool_url)
-            if response.status_code == 200:
-                return response.json().get('proxy')
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Failed to fetch proxy: {str(e)}")
-            return None
+    if proxy_manager:
+        return proxy_manager.acquire(reserve=False)
+    return None
+
+# Function to run blocking file work off the event loop
+async def run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+# Async variant of get_proxy; waiting for the prefetcher happens off the event loop
+async def get_proxy_async(session):
+    if proxy_manager:
+        return await run_blocking(proxy_manager.acquire, None, None, False)
     return None
 
 # Function to initialize SQLite database and tables
 def setup_database():
-    conn = sqlite3.connect(DB_FILE)
+    conn = connect(DB_FILE)
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS profiles (
@@ -62,110 +137,529 @@ def setup_database():
             id INTEGER PRIMARY KEY
         )
     ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS comments_checkpoints (
+            profile_id INTEGER PRIMARY KEY,
+            next_offset INTEGER,
+            position INTEGER,
+            pages INTEGER,
+            complete INTEGER
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS comments_watermarks (
+            profile_id INTEGER PRIMARY KEY,
+            newest_comment_id INTEGER,
+            newest_timestamp INTEGER,
+            comment_count INTEGER,
+            refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute(MISSING_TABLE)
+    c.executescript(TYPING_TABLES)
+    if config.get('search_index', True):
+        c.executescript(SEARCH_TABLES)
+    c.executescript(RETRY_TABLES)
     conn.commit()
     conn.close()
 
 # Initialize database
 setup_database()
 
+# Writes are queued to a single batching writer thread; reads use pooled connections
+db = Database.from_config(DB_FILE, config)
+
+# Function to load every processed profile ID into memory once at startup
+def load_processed_ids():
+    processed = IdBitmap()
+    with db.readers.connection() as conn:
+        for (profile_id,) in conn.execute('SELECT id FROM processed_profiles'):
+            processed.add(profile_id)
+    return processed
+
+# Function to load the IDs confirmed missing, including 404s recorded in `errors`
+# before missing_profiles existed
+def load_missing_ids():
+    missing = IdBitmap()
+    with db.readers.connection() as conn:
+        for (profile_id,) in conn.execute('''
+            SELECT id FROM missing_profiles
+            UNION SELECT id FROM errors WHERE error_message LIKE '%Status code 404'
+        '''):
+            missing.add(profile_id)
+    return missing
+
+processed_ids = load_processed_ids()
+missing_ids = load_missing_ids()
+
+# Failed profiles waiting for their next attempt, and those given up on (dead letters)
+retry_queue = RetryQueue.from_config(db, config)
+retry_queue.load()
+registry.gauge('scraper_retry_queue', 'Failed profiles waiting for a retry').track(lambda: len(retry_queue))
+
+# IDs with a final outcome (processed, missing or dead-lettered), which are never scheduled again
+settled_ids = IdBitmap([*processed_ids, *missing_ids, *retry_queue.dead])
+
+# Function to pick up the outcomes other workers stored for [start_id, end_id) since startup
+def load_settled_range(start_id, end_id):
+    with db.readers.connection() as conn:
+        for (profile_id,) in conn.execute('SELECT id FROM processed_profiles WHERE id >= ? AND id < ?',
+                                          (start_id, end_id)):
+            processed_ids.add(profile_id)
+            settled_ids.add(profile_id)
+        for (profile_id,) in conn.execute('''
+            SELECT id FROM missing_profiles WHERE id >= ? AND id < ?
+            UNION SELECT id FROM errors WHERE id >= ? AND id < ? AND error_message LIKE '%Status code 404'
+        ''', (start_id, end_id, start_id, end_id)):
+            missing_ids.add(profile_id)
+            settled_ids.add(profile_id)
+    for profile_id in retry_queue.load(start_id, end_id):
+        settled_ids.add(profile_id)
+
 def is_profile_processed(profile_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT id FROM processed_profiles WHERE id = ?', (profile_id,))
-    result = c.fetchone()
-    conn.close()
-    return result is not None
+    return profile_id in processed_ids
 
 def mark_profile_as_processed(profile_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('INSERT OR REPLACE INTO processed_profiles (id) VALUES (?)', (profile_id,))
-    conn.commit()
-    conn.close()
+    processed_ids.add(profile_id)
+    settled_ids.add(profile_id)
+    db.execute('INSERT OR REPLACE INTO processed_profiles (id) VALUES (?)', (profile_id,))
+    retry_queue.resolve(profile_id)
+    PROFILES.inc(('processed',))
 
-def save_error(profile_id, error_message):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('INSERT OR REPLACE INTO errors (id, error_message) VALUES (?, ?)', (profile_id, error_message))
-    conn.commit()
-    conn.close()
+def mark_profile_missing(profile_id):
+    missing_ids.add(profile_id)
+    settled_ids.add(profile_id)
+    db.execute('INSERT OR REPLACE INTO missing_profiles (id) VALUES (?)', (profile_id,))
+    db.execute('DELETE FROM errors WHERE id = ?', (profile_id,))
+    retry_queue.resolve(profile_id)
+    PROFILES.inc(('missing',))
 
-def get_last_processed_id():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT MAX(id) FROM processed_profiles')
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result[0] is not None else 0
+# Function to record a failed attempt and schedule the next one. `category` is one of
+# network, server, throttled, not_found, client, parse or other (see retry_queue.py).
+def save_error(profile_id, error_message, category='other'):
+    db.execute('INSERT OR REPLACE INTO errors (id, error_message) VALUES (?, ?)', (profile_id, error_message))
+    PROFILES.inc(('failed',))
+    delay = retry_queue.record_failure(profile_id, category, error_message)
+    if delay is None:
+        settled_ids.add(profile_id)
+        logging.warning(f"Profile ID {profile_id} failed too often ({category}); moved to the dead letters")
+    else:
+        logging.info(f"Retrying profile ID {profile_id} ({category}) in {delay:.0f}s")
+
+# Function to send one GET, through the best managed proxy if the proxy manager is
+# in use (reusing that proxy's keep-alive session). A network error or a status that
+# points at the proxy is retried through another proxy up to proxy_retries times.
+# Returns (status, body bytes, response headers).
+def send_request(url, proxy, headers):
+    failed = last = None
+    for _ in range(PROXY_RETRIES + 1 if proxy_manager else 1):
+        if proxy_manager:
+            proxy = proxy_manager.acquire(exclude=failed)
+            if proxy is None:
+                break
+        rate_limiter.wait(url, proxy)
+        started = time.monotonic()
+        try:
+            if proxy_manager:
+                response = proxy_manager.session(proxy).get(url, headers=headers, timeout=proxy_manager.request_timeout)
+            else:
+                proxies = {"http": f"http://{proxy}", "https": f"http://{proxy}"} if proxy else None
+                response = requests.get(url, proxies=proxies, headers=headers)
+        except requests.exceptions.RequestException as e:
+            record_response(started, None, proxy=proxy, url=url)
+            last = e
+            failed = proxy
+            continue
+        record_response(started, response.status_code, response.headers, proxy, url, len(response.content))
+        last = (response.status_code, response.content, response.headers)
+        if not (proxy_manager and is_proxy_failure(response.status_code)):
+            break
+        failed = proxy
+    if last is None:
+        raise requests.exceptions.ProxyError("No healthy proxy available")
+    if isinstance(last, Exception):
+        raise last
+    return last
+
+# Async variant of send_request; the session keeps connections alive between
+# requests, per proxy as well
+async def send_request_async(session, url, proxy, headers):
+    failed = last = None
+    for _ in range(PROXY_RETRIES + 1 if proxy_manager else 1):
+        if proxy_manager:
+            proxy = proxy_manager.acquire(exclude=failed, timeout=0) or await run_blocking(proxy_manager.acquire, failed)
+            if proxy is None:
+                break
+        await rate_limiter.wait_async(url, proxy)
+        started = time.monotonic()
+        try:
+            async with session.get(url, proxy=f"http://{proxy}" if proxy else None, headers=headers) as response:
+                body = await response.read()
+                record_response(started, response.status, response.headers, proxy, url, len(body))
+                last = (response.status, body, response.headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            record_response(started, None, proxy=proxy, url=url)
+            last = e
+            failed = proxy
+            continue
+        if not (proxy_manager and is_proxy_failure(last[0])):
+            break
+        failed = proxy
+    if last is None:
+        raise aiohttp.ClientError("No healthy proxy available")
+    if isinstance(last, Exception):
+        raise last
+    return last
+
+# Function to GET a JSON payload through the rate limiter and the response cache;
+# returns (status, payload), the payload being None unless the status is 200
+def get_json(url, proxy, revalidate=False):
+    try:
+        return cached_get(response_cache, url, lambda headers: send_request(url, proxy, headers),
+                          revalidate=revalidate)
+    except ValueError as e:
+        raise requests.exceptions.InvalidJSONError(f"Invalid JSON from {url}: {str(e)}")
+
+# Async variant of get_json
+async def get_json_async(session, url, proxy, revalidate=False):
+    return await cached_get_async(response_cache, url, lambda headers: send_request_async(session, url, proxy, headers),
+                                  revalidate=revalidate)
 
 # Function to fetch data from API with proxy support
 def fetch_data(profile_id, proxy):
     try:
-        proxies = {"http": f"http://{proxy}", "https": f"http://{proxy}"} if proxy else None
-        response = requests.get(API_URL_PROFILE.format(profile_id), proxies=proxies)
-        if response.status_code == 200:
-            return response.json()
+        status, data = get_json(API_URL_PROFILE.format(profile_id), proxy)
+        if status == 200:
+            return data
+        elif status == 404:
+            logging.info(f"Profile ID {profile_id} does not exist")
+            mark_profile_missing(profile_id)
+            return None
         else:
-            error_message = f"Failed to fetch data for profile ID {profile_id}: Status code {response.status_code}"
-            save_error(profile_id, error_message)
+            error_message = f"Failed to fetch data for profile ID {profile_id}: Status code {status}"
             logging.error(error_message)
+            save_error(profile_id, error_message, classify_status(status))
             return None
+    except CacheMiss as e:
+        logging.warning(f"No data for profile ID {profile_id}: {str(e)}")
+        return None
     except requests.exceptions.RequestException as e:
         error_message = f"Request error for profile ID {profile_id}: {str(e)}"
-        save_error(profile_id, error_message)
         logging.error(error_message)
+        save_error(profile_id, error_message,
+                   'parse' if isinstance(e, requests.exceptions.InvalidJSONError) else 'network')
         return None
 
-# Function to save detailed typing data to JSON file
-def save_typing_data(profile_id, data):
-    typing_data = {
+# Async variant of fetch_data
+async def fetch_data_async(session, profile_id, proxy):
+    try:
+        status, data = await get_json_async(session, API_URL_PROFILE.format(profile_id), proxy)
+        if status == 200:
+            return data
+        elif status == 404:
+            logging.info(f"Profile ID {profile_id} does not exist")
+            mark_profile_missing(profile_id)
+            return None
+        else:
+            error_message = f"Failed to fetch data for profile ID {profile_id}: Status code {status}"
+            logging.error(error_message)
+            save_error(profile_id, error_message, classify_status(status))
+            return None
+    except CacheMiss as e:
+        logging.warning(f"No data for profile ID {profile_id}: {str(e)}")
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        error_message = f"Request error for profile ID {profile_id}: {str(e)}"
+        logging.error(error_message)
+        save_error(profile_id, error_message, 'network')
+        return None
+    except ValueError as e:
+        error_message = f"Invalid JSON for profile ID {profile_id}: {str(e)}"
+        logging.error(error_message)
+        save_error(profile_id, error_message, 'parse')
+        return None
+
+# Function to extract the detailed typing data of a profile
+def build_typing_data(data):
+    return {
         'functions': data.get('functions', []),
         'systems': data.get('systems', []),
         'breakdown_systems': data.get('breakdown_systems', {}),
         'breakdown_config': data.get('breakdown_config', {}),
         'mbti_letter_stats': data.get('mbti_letter_stats', [])
     }
-    file_path = Path(TYPING_DATA_DIR) / f'{profile_id}_typing.json'
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(file_path, 'w') as f:
-        json.dump(typing_data, f, indent=2)
 
-# Function to fetch comments for a profile ID with proxy support
+# Function to save detailed typing data to the record store and the typing vote tables
+def save_typing_data(profile_id, data):
+    store_typing_data(profile_id, data['subcat_link_info']['cat_id'], build_typing_data(data))
+
+def store_typing_data(profile_id, cat_id, typing_data):
+    store.write('typing', profile_id, typing_data)
+    save_typing_votes(db, profile_id, cat_id, typing_data)
+
+# Function to report a comments page that could not be fetched. While a profile is being
+# scraped the failure is recorded and retried like a failed profile fetch (the status
+# is in parentheses so that a comments 404 is not mistaken for a missing profile).
+def comments_page_failed(profile_id, offset, error, category):
+    error_message = f"Failed to fetch comments for profile ID {profile_id} at offset {offset} ({error})"
+    logging.error(error_message)
+    if not is_profile_processed(profile_id):
+        save_error(profile_id, error_message, category)
+
+# Function to fetch one page of comments; returns None if the page could not be fetched.
+# With `revalidate` a cached page is checked with the API even while it is fresh.
+def fetch_comments_page(profile_id, offset, proxy, url_template=None, revalidate=False):
+    try:
+        status, data = get_json((url_template or API_URL_COMMENTS).format(profile_id, offset), proxy, revalidate)
+        if status == 200:
+            return data
+        comments_page_failed(profile_id, offset, f"Status code {status}", classify_status(status))
+    except CacheMiss as e:
+        logging.warning(f"No comments for profile ID {profile_id}: {str(e)}")
+    except requests.exceptions.RequestException as e:
+        comments_page_failed(profile_id, offset, f"Request error: {str(e)}",
+                             'parse' if isinstance(e, requests.exceptions.InvalidJSONError) else 'network')
+    return None
+
+# Async variant of fetch_comments_page
+async def fetch_comments_page_async(session, profile_id, offset, proxy, url_template=None, revalidate=False):
+    try:
+        status, data = await get_json_async(session, (url_template or API_URL_COMMENTS).format(profile_id, offset), proxy,
+                                            revalidate)
+        if status == 200:
+            return data
+        comments_page_failed(profile_id, offset, f"Status code {status}", classify_status(status))
+    except CacheMiss as e:
+        logging.warning(f"No comments for profile ID {profile_id}: {str(e)}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        comments_page_failed(profile_id, offset, f"Request error: {str(e)}", 'network')
+    except ValueError as e:
+        comments_page_failed(profile_id, offset, f"Invalid JSON: {str(e)}", 'parse')
+    return None
+
+# Function to fetch comments for a profile ID with proxy support; returns None if a
+# page could not be fetched, so the profile is retried rather than stored incomplete
 def fetch_comments(profile_id, proxy):
     offset = 0
+    pages = 0
     comments_data = []
     while True:
-        try:
-            proxies = {"http": f"http://{proxy}", "https": f"http://{proxy}"} if proxy else None
-            response = requests.get(API_URL_COMMENTS.format(profile_id, offset), proxies=proxies)
-            if response.status_code == 200:
-                data = response.json()
-                comments_data.extend(data.get('comments', []))
-                offset = data.get('next_offset', 0)
-                if not data.get('has_more', False):
-                    break
-            else:
-                logging.error(f"Failed to fetch comments for profile ID {profile_id}: Status code {response.status_code}")
-                break
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request error for profile ID {profile_id}: {str(e)}")
+        data = fetch_comments_page(profile_id, offset, proxy)
+        if data is None:
+            return None
+        pages += 1
+        comments_data.extend(data.get('comments', []))
+        offset = data.get('next_offset', 0)
+        if not data.get('has_more', False):
             break
-    
+
+    COMMENT_PAGES.observe(pages)
     return comments_data
 
-# Function to save comments to JSON file
+# Async variant of fetch_comments
+async def fetch_comments_async(session, profile_id, proxy):
+    offset = 0
+    pages = 0
+    comments_data = []
+    while True:
+        data = await fetch_comments_page_async(session, profile_id, offset, proxy)
+        if data is None:
+            return None
+        pages += 1
+        comments_data.extend(data.get('comments', []))
+        offset = data.get('next_offset', 0)
+        if not data.get('has_more', False):
+            break
+
+    COMMENT_PAGES.observe(pages)
+    return comments_data
+
+# Function to save comments to the record store
 def save_comments(profile_id, comments_data):
-    file_path = Path(COMMENTS_DATA_DIR) / f'{profile_id}_comments.json'
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(file_path, 'w') as f:
-        json.dump(comments_data, f, indent=2)
+    store.write('comments', profile_id, comments_data)
+    save_comments_watermark(profile_id, comments_watermark(comments_data))
+    if config.get('search_index', True):
+        index_comments(db, profile_id, comments_data, COMMENT_TEXT_FIELD, COMMENT_ID_FIELD)
+
+# Function to compute the watermark of a set of comments: the newest comment id
+# and timestamp, and how many comments there are
+def comments_watermark(comments):
+    watermark = {'newest_comment_id': None, 'newest_timestamp': None, 'comment_count': 0}
+    for comment in comments:
+        watermark['comment_count'] += 1
+        comment_id = comment.get(COMMENT_ID_FIELD)
+        timestamp = comment.get(COMMENT_TIMESTAMP_FIELD)
+        if comment_id is not None and (watermark['newest_comment_id'] is None or comment_id > watermark['newest_comment_id']):
+            watermark['newest_comment_id'] = comment_id
+        if timestamp is not None and (watermark['newest_timestamp'] is None or timestamp > watermark['newest_timestamp']):
+            watermark['newest_timestamp'] = timestamp
+    return watermark
+
+def save_comments_watermark(profile_id, watermark):
+    db.execute('''
+        INSERT OR REPLACE INTO comments_watermarks (profile_id, newest_comment_id, newest_timestamp, comment_count)
+        VALUES (?, ?, ?, ?)
+    ''', (profile_id, watermark['newest_comment_id'], watermark['newest_timestamp'], watermark['comment_count']))
+
+# Function to load a profile's watermark; profiles stored before watermarks existed
+# get one computed from their stored comments
+def load_comments_watermark(profile_id):
+    row = db.fetchone('SELECT newest_comment_id, newest_timestamp, comment_count FROM comments_watermarks WHERE profile_id = ?',
+                      (profile_id,))
+    if row is None:
+        return comments_watermark(store.read_items('comments', profile_id))
+    return {'newest_comment_id': row[0], 'newest_timestamp': row[1], 'comment_count': row[2]}
+
+def is_newer_comment(comment, watermark):
+    if watermark['newest_comment_id'] is not None and comment.get(COMMENT_ID_FIELD) is not None:
+        return comment[COMMENT_ID_FIELD] > watermark['newest_comment_id']
+    if watermark['newest_timestamp'] is not None and comment.get(COMMENT_TIMESTAMP_FIELD) is not None:
+        return comment[COMMENT_TIMESTAMP_FIELD] > watermark['newest_timestamp']
+    return True
+
+# Function to fetch only the comments newer than the watermark, reading pages newest
+# first and stopping at the first page that reaches already-stored comments. Cached
+# pages are always revalidated, since they are polled for changes.
+# Returns None if a page could not be fetched.
+def fetch_new_comments(profile_id, proxy, watermark):
+    offset = 0
+    new_comments = []
+    while True:
+        data = fetch_comments_page(profile_id, offset, proxy, API_URL_COMMENTS_NEWEST, True)
+        if data is None:
+            return None
+        page = data.get('comments', [])
+        newer = [comment for comment in page if is_newer_comment(comment, watermark)]
+        new_comments.extend(newer)
+        if len(newer) < len(page) or not data.get('has_more', False):
+            return new_comments
+        offset = data.get('next_offset', 0)
+
+# Async variant of fetch_new_comments
+async def fetch_new_comments_async(session, profile_id, proxy, watermark):
+    offset = 0
+    new_comments = []
+    while True:
+        data = await fetch_comments_page_async(session, profile_id, offset, proxy, API_URL_COMMENTS_NEWEST, True)
+        if data is None:
+            return None
+        page = data.get('comments', [])
+        newer = [comment for comment in page if is_newer_comment(comment, watermark)]
+        new_comments.extend(newer)
+        if len(newer) < len(page) or not data.get('has_more', False):
+            return new_comments
+        offset = data.get('next_offset', 0)
+
+# Key that identifies a comment: its ID, or its whole content when the API sent no ID
+def comment_key(comment):
+    if comment.get(COMMENT_ID_FIELD) is not None:
+        return comment[COMMENT_ID_FIELD]
+    return ('content', json.dumps(comment, sort_keys=True))
+
+# Function to merge newly fetched comments into the stored ones, dropping duplicates
+# (pages shift while new comments arrive); returns the number of comments added
+def merge_new_comments(profile_id, new_comments):
+    if not new_comments:
+        return 0
+    seen = set()
+    merged = []
+    for comment in new_comments:
+        key = comment_key(comment)
+        if key not in seen:
+            seen.add(key)
+            merged.append(comment)
+    added = len(merged)
+    merged.extend(comment for comment in store.read_items('comments', profile_id)
+                  if comment_key(comment) not in seen)
+    save_comments(profile_id, merged)
+    return added
+
+# Function to load the streaming checkpoint of a profile's comments
+def load_comments_checkpoint(profile_id):
+    row = db.fetchone('SELECT next_offset, position, pages, complete FROM comments_checkpoints WHERE profile_id = ?',
+                      (profile_id,))
+    if row is None:
+        return {'next_offset': 0, 'position': 0, 'pages': 0, 'complete': False}
+    return {'next_offset': row[0], 'position': row[1], 'pages': row[2], 'complete': bool(row[3])}
+
+def save_comments_checkpoint(profile_id, checkpoint):
+    db.execute('''
+        INSERT OR REPLACE INTO comments_checkpoints (profile_id, next_offset, position, pages, complete)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (profile_id, checkpoint['next_offset'], checkpoint['position'], checkpoint['pages'], int(checkpoint['complete'])))
+
+# Function to start or resume streaming a profile's comments. Pages stored after
+# the last saved checkpoint are dropped, since they will be fetched again.
+def begin_comments_stream(profile_id):
+    checkpoint = load_comments_checkpoint(profile_id)
+    if not checkpoint['complete']:
+        store.truncate('comments', profile_id, checkpoint['position'])
+    return checkpoint
+
+# Function to append one comments page to the record store and advance the checkpoint
+def store_comments_page(profile_id, data, checkpoint):
+    checkpoint['position'] = store.append('comments', profile_id, data.get('comments', []))
+    checkpoint['next_offset'] = data.get('next_offset', 0)
+    checkpoint['pages'] += 1
+    checkpoint['complete'] = not data.get('has_more', False)
+    save_comments_checkpoint(profile_id, checkpoint)
+    if checkpoint['complete']:
+        COMMENT_PAGES.observe(checkpoint['pages'])
+        save_comments_watermark(profile_id, comments_watermark(store.read_items('comments', profile_id)))
+        if config.get('search_index', True):
+            index_comments(db, profile_id, store.read_items('comments', profile_id), COMMENT_TEXT_FIELD,
+                           COMMENT_ID_FIELD)
+
+# Streaming variant of fetch_comments + save_comments: each page is written as it
+# arrives, so memory is bounded by one page. Returns True once every page is stored.
+def stream_comments(profile_id, proxy):
+    checkpoint = begin_comments_stream(profile_id)
+    while not checkpoint['complete']:
+        data = fetch_comments_page(profile_id, checkpoint['next_offset'], proxy)
+        if data is None:
+            return False
+        store_comments_page(profile_id, data, checkpoint)
+    return True
+
+# Async variant of stream_comments
+async def stream_comments_async(session, profile_id, proxy):
+    checkpoint = await run_blocking(begin_comments_stream, profile_id)
+    while not checkpoint['complete']:
+        data = await fetch_comments_page_async(session, profile_id, checkpoint['next_offset'], proxy)
+        if data is None:
+            return False
+        await run_blocking(store_comments_page, profile_id, data, checkpoint)
+    return True
+
+# Function to extract the profile row; raises KeyError if the payload is incomplete
+def build_profile(data):
+    return {
+        'id': data['id'],
+        'mbti_profile': data['mbti_profile'],
+        'wiki_description': data['wiki_description'],
+        'sub_cat_id': data['subcat_link_info']['sub_cat_id'],
+        'cat_id': data['subcat_link_info']['cat_id'],
+        'property_id': data['subcat_link_info']['property_id'],
+        'total_vote_counts': data['total_vote_counts']
+    }
+
+# Function to save the profile row to the database
+def save_profile(data):
+    save_profile_row(build_profile(data))
+
+def save_profile_row(profile):
+    db.execute('''
+        INSERT OR REPLACE INTO profiles 
+        (id, mbti_profile, wiki_description, sub_cat_id, cat_id, property_id, total_vote_counts)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (profile['id'], profile['mbti_profile'], profile['wiki_description'], profile['sub_cat_id'],
+          profile['cat_id'], profile['property_id'], profile['total_vote_counts']))
 
 def process_profile(profile_id):
     if is_profile_processed(profile_id):
         logging.info(f"Profile ID {profile_id} is already processed. Skipping.")
         return
 
-    time.sleep(config.get('delay_between_requests', 1.5))  # Configurable delay
     proxy = get_proxy()
     if not proxy and config.get('proxy_enabled', False):
         logging.warning(f"No proxy available for profile ID {profile_id}. Skipping.")
@@ -174,58 +668,367 @@ def process_profile(profile_id):
     data = fetch_data(profile_id, proxy)
     if data:
         try:
-            profile = {
-                'id': data['id'],
-                'mbti_profile': data['mbti_profile'],
-                'wiki_description': data['wiki_description'],
-                'sub_cat_id': data['subcat_link_info']['sub_cat_id'],
-                'cat_id': data['subcat_link_info']['cat_id'],
-                'property_id': data['subcat_link_info']['property_id'],
-                'total_vote_counts': data['total_vote_counts']
-            }
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute('''
-                INSERT OR REPLACE INTO profiles 
-                (id, mbti_profile, wiki_description, sub_cat_id, cat_id, property_id, total_vote_counts)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (profile['id'], profile['mbti_profile'], profile['wiki_description'], profile['sub_cat_id'],
-                  profile['cat_id'], profile['property_id'], profile['total_vote_counts']))
-            conn.commit()
-            conn.close()
+            save_profile(data)
             save_typing_data(profile_id, data)
-            comments_data = fetch_comments(profile_id, proxy)
-            save_comments(profile_id, comments_data)
+            if config.get('comments_streaming', False):
+                if not stream_comments(profile_id, proxy):
+                    logging.warning(f"Comments for profile ID {profile_id} are incomplete; retrying the profile later")
+                    return
+            else:
+                comments_data = fetch_comments(profile_id, proxy)
+                if comments_data is None:
+                    logging.warning(f"Comments for profile ID {profile_id} are incomplete; retrying the profile later")
+                    return
+                save_comments(profile_id, comments_data)
             logging.info(f"Processed profile ID {profile_id}")
             mark_profile_as_processed(profile_id)
         except KeyError as e:
             error_message = f"KeyError processing profile ID {profile_id}: {str(e)}"
-            save_error(profile_id, error_message)
             logging.error(error_message)
+            save_error(profile_id, error_message, 'parse')
         except Exception as e:
             error_message = f"Error processing profile ID {profile_id}: {str(e)}"
+            logging.error(error_message)
             save_error(profile_id, error_message)
+    else:
+        logging.warning(f"No data fetched for profile ID {profile_id}")
+
+async def process_profile_async(session, profile_id):
+    if is_profile_processed(profile_id):
+        logging.info(f"Profile ID {profile_id} is already processed. Skipping.")
+        return
+
+    proxy = await get_proxy_async(session)
+    if not proxy and config.get('proxy_enabled', False):
+        logging.warning(f"No proxy available for profile ID {profile_id}. Skipping.")
+        return
+
+    data = await fetch_data_async(session, profile_id, proxy)
+    if data:
+        try:
+            save_profile(data)
+            await run_blocking(save_typing_data, profile_id, data)
+            if config.get('comments_streaming', False):
+                if not await stream_comments_async(session, profile_id, proxy):
+                    logging.warning(f"Comments for profile ID {profile_id} are incomplete; retrying the profile later")
+                    return
+            else:
+                comments_data = await fetch_comments_async(session, profile_id, proxy)
+                if comments_data is None:
+                    logging.warning(f"Comments for profile ID {profile_id} are incomplete; retrying the profile later")
+                    return
+                await run_blocking(save_comments, profile_id, comments_data)
+            logging.info(f"Processed profile ID {profile_id}")
+            mark_profile_as_processed(profile_id)
+        except KeyError as e:
+            error_message = f"KeyError processing profile ID {profile_id}: {str(e)}"
             logging.error(error_message)
+            save_error(profile_id, error_message, 'parse')
+        except Exception as e:
+            error_message = f"Error processing profile ID {profile_id}: {str(e)}"
+            logging.error(error_message)
+            save_error(profile_id, error_message)
     else:
         logging.warning(f"No data fetched for profile ID {profile_id}")
 
-# Function to fetch all profile IDs to process
+# Pipeline stage: proxy lookup and profile fetch
+def fetch_stage(profile_id):
+    if is_profile_processed(profile_id):
+        return None
+    proxy = get_proxy()
+    if not proxy and config.get('proxy_enabled', False):
+        logging.warning(f"No proxy available for profile ID {profile_id}. Skipping.")
+        return None
+    data = fetch_data(profile_id, proxy)
+    if not data:
+        logging.warning(f"No data fetched for profile ID {profile_id}")
+        return None
+    return {'profile_id': profile_id, 'proxy': proxy, 'data': data}
+
+# Pipeline stage: validate the payload and build the rows to store
+def parse_stage(item):
+    profile_id = item['profile_id']
+    data = item.pop('data')
+    try:
+        item['profile'] = build_profile(data)
+        item['typing_data'] = build_typing_data(data)
+    except KeyError as e:
+        error_message = f"KeyError processing profile ID {profile_id}: {str(e)}"
+        logging.error(error_message)
+        save_error(profile_id, error_message, 'parse')
+        return None
+    return item
+
+# Pipeline stage: comments pagination (streamed comments are stored page by page here)
+def comments_stage(item):
+    profile_id = item['profile_id']
+    if config.get('comments_streaming', False):
+        if not stream_comments(profile_id, item['proxy']):
+            logging.warning(f"Comments for profile ID {profile_id} are incomplete; retrying the profile later")
+            return None
+        item['comments'] = None
+    else:
+        item['comments'] = fetch_comments(profile_id, item['proxy'])
+        if item['comments'] is None:
+            logging.warning(f"Comments for profile ID {profile_id} are incomplete; retrying the profile later")
+            return None
+    return item
+
+# Pipeline stage: database rows and records
+def persist_stage(item):
+    profile_id = item['profile_id']
+    try:
+        save_profile_row(item['profile'])
+        store_typing_data(profile_id, item['profile']['cat_id'], item['typing_data'])
+        if item['comments'] is not None:
+            save_comments(profile_id, item['comments'])
+        logging.info(f"Processed profile ID {profile_id}")
+        mark_profile_as_processed(profile_id)
+    except Exception as e:
+        error_message = f"Error processing profile ID {profile_id}: {str(e)}"
+        logging.error(error_message)
+        save_error(profile_id, error_message)
+        return None
+    return item
+
+# Function to fetch only the comments posted since a processed profile was last stored
+def refresh_profile(profile_id):
+    proxy = get_proxy()
+    if not proxy and config.get('proxy_enabled', False):
+        logging.warning(f"No proxy available for profile ID {profile_id}. Skipping.")
+        return
+
+    watermark = load_comments_watermark(profile_id)
+    new_comments = fetch_new_comments(profile_id, proxy, watermark)
+    if new_comments is None:
+        logging.warning(f"Could not refresh comments for profile ID {profile_id}")
+        return
+    added = merge_new_comments(profile_id, new_comments)
+    logging.info(f"Refreshed profile ID {profile_id}: {added} new comments")
+
+async def refresh_profile_async(session, profile_id):
+    proxy = await get_proxy_async(session)
+    if not proxy and config.get('proxy_enabled', False):
+        logging.warning(f"No proxy available for profile ID {profile_id}. Skipping.")
+        return
+
+    watermark = await run_blocking(load_comments_watermark, profile_id)
+    new_comments = await fetch_new_comments_async(session, profile_id, proxy, watermark)
+    if new_comments is None:
+        logging.warning(f"Could not refresh comments for profile ID {profile_id}")
+        return
+    added = await run_blocking(merge_new_comments, profile_id, new_comments)
+    logging.info(f"Refreshed profile ID {profile_id}: {added} new comments")
+
+# Function to fetch all profile IDs to process: the first unsettled IDs from
+# start_id onwards (failed IDs among them are left to the retry queue's schedule)
 def fetch_all_profile_ids(start_id):
-    return range(start_id, start_id + config.get('num_profiles_to_scrape', 1000))
+    return settled_ids.missing(start_id, config.get('num_profiles_to_scrape', 1000))
+
+# Function to run a per-profile task once the concurrency controller grants a slot
+def run_with_limit(task, profile_id):
+    concurrency_controller.acquire()
+    try:
+        task(profile_id)
+    finally:
+        concurrency_controller.release()
+
+async def run_with_limit_async(task, session, profile_id):
+    await concurrency_controller.acquire_async()
+    try:
+        await task(session, profile_id)
+    finally:
+        await concurrency_controller.release_async()
+
+# Function to show the adaptive concurrency limit next to the progress bar
+def show_concurrency(progress):
+    if concurrency_controller:
+        stats = concurrency_controller.stats()
+        progress.set_postfix(limit=stats['limit'], in_flight=stats['in_flight'])
 
 # Function to handle fetching and processing in sequential order
-def fetch_and_process_profiles(profile_ids):
+def fetch_and_process_profiles(profile_ids, task=process_profile):
     max_workers = config.get('max_workers', 10)
+    if concurrency_controller:
+        # The pool is sized for the upper bound; the controller decides how many run
+        max_workers = concurrency_controller.max_limit
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_profile, profile_id) for profile_id in profile_ids]
-        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing profiles"):
+        if concurrency_controller:
+            futures = [executor.submit(run_with_limit, task, profile_id) for profile_id in profile_ids]
+        else:
+            futures = [executor.submit(task, profile_id) for profile_id in profile_ids]
+        progress = tqdm(as_completed(futures), total=len(futures), desc="Processing profiles")
+        for future in progress:
             future.result()  # This will raise any exceptions caught during the execution
+            show_concurrency(progress)
+
+# Async variant of fetch_and_process_profiles: a fixed number of coroutines share
+# one bounded keep-alive connection pool instead of one thread per request
+async def fetch_and_process_profiles_async(profile_ids, task=process_profile_async):
+    concurrency = config.get('async_concurrency', 100)
+    connector = aiohttp.TCPConnector(
+        limit=config.get('async_max_connections', 100),
+        limit_per_host=config.get('async_max_connections_per_host', 0),
+        keepalive_timeout=config.get('async_keepalive_timeout', 30)
+    )
+    timeout = aiohttp.ClientTimeout(total=config.get('async_request_timeout', 30))
+    pending_ids = iter(profile_ids)
+    with tqdm(total=len(profile_ids), desc="Processing profiles") as progress:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            if concurrency_controller:
+                concurrency = concurrency_controller.max_limit
+
+            async def worker():
+                for profile_id in pending_ids:
+                    try:
+                        if concurrency_controller:
+                            await run_with_limit_async(task, session, profile_id)
+                        else:
+                            await task(session, profile_id)
+                    finally:
+                        progress.update(1)
+                        show_concurrency(progress)
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+# Pipeline variant of fetch_and_process_profiles: fetch, parse, comments and persist
+# run as separate stages with their own workers, connected by bounded queues
+def fetch_and_process_profiles_pipeline(profile_ids):
+    queue_size = config.get('pipeline_queue_size', 100)
+    stages = [
+        Stage('fetch', fetch_stage, config.get('pipeline_fetch_workers', 10), queue_size),
+        Stage('parse', parse_stage, config.get('pipeline_parse_workers', 1), queue_size),
+        Stage('comments', comments_stage, config.get('pipeline_comments_workers', 10), queue_size),
+        Stage('persist', persist_stage, config.get('pipeline_persist_workers', 2), queue_size)
+    ]
+    with tqdm(total=len(profile_ids), desc="Processing profiles") as progress:
+        pipeline = Pipeline(stages, on_exit=lambda: progress.update(1),
+                            report_interval=config.get('pipeline_report_interval', 10))
+        pipeline.run(profile_ids)
+
+# Function to run `task` over the given IDs in the configured fetch mode
+def dispatch_profiles(profile_ids, task=process_profile, task_async=process_profile_async):
+    if config.get('fetch_mode', 'threads') == 'async':
+        asyncio.run(fetch_and_process_profiles_async(profile_ids, task_async))
+    elif config.get('fetch_mode') == 'pipeline' and task is process_profile:
+        fetch_and_process_profiles_pipeline(profile_ids)
+    else:
+        fetch_and_process_profiles(profile_ids, task)
+
+# Function to run `task` over the given IDs. Profiles are scraped in rounds of
+# retry_round_size IDs, each led by the failed profiles (in `id_range` if given) whose
+# next attempt is due; IDs still waiting for a retry are left to the retry queue.
+# Once the IDs run out, retries due within retry_max_wait seconds are waited for, so
+# transient failures are recovered in the same run; later ones are left for a later run.
+def run_profiles(profile_ids, task=process_profile, task_async=process_profile_async, id_range=None):
+    if task is not process_profile:
+        dispatch_profiles(profile_ids, task, task_async)
+        return
+    start_id, end_id = id_range or (None, None)
+    round_size = config.get('retry_round_size', 1000)
+    pending = [profile_id for profile_id in profile_ids if profile_id not in retry_queue]
+    while True:
+        retry_ids = retry_queue.due(start_id, end_id)
+        batch, pending = pending[:round_size], pending[round_size:]
+        if retry_ids or batch:
+            if retry_ids:
+                logging.info(f"Retrying {len(retry_ids)} failed profiles along with {len(batch)} new IDs")
+            dispatch_profiles(retry_ids + batch)
+            continue
+        wait = retry_queue.next_due_in(start_id, end_id)
+        if wait is None:
+            break
+        if wait > config.get('retry_max_wait', 300):
+            logging.info(f"{len(retry_queue)} failed profiles left for a later run; the next retry is due in {wait:.0f}s")
+            break
+        logging.info(f"Waiting {wait:.0f}s for the next retry of failed profiles")
+        time.sleep(wait)
+
+# Function to scrape num_profiles_to_scrape IDs in rounds of discovery_round_size,
+# each planned from the outcomes so far so that dense ID ranges come first
+def discover_profiles():
+    planner = IdSpacePlanner.from_config(config, processed_ids, settled_ids)
+    remaining = config.get('num_profiles_to_scrape', 1000)
+    while remaining > 0:
+        profile_ids = planner.plan(config.get('start_id', 1), min(config.get('discovery_round_size', 1000), remaining))
+        if not profile_ids:
+            break
+        found = len(processed_ids)
+        run_profiles(profile_ids)
+        logging.info(f"ID discovery round: {len(processed_ids) - found} of {len(profile_ids)} IDs found")
+        remaining -= len(profile_ids)
+
+# Function to work through leased shards of the ID space until none is left. The shards
+# cover shard_end_id (default start_id + num_profiles_to_scrape) from start_id in
+# steps of shard_size; any number of workers, local or connected to a coordinator,
+# can run this at once and each shard is scraped by one of them.
+def run_shards():
+    start_id = config.get('start_id', 1)
+    end_id = config.get('shard_end_id') or start_id + config.get('num_profiles_to_scrape', 1000)
+    worker_id = config.get('worker_id') or f"{socket.gethostname()}-{os.getpid()}"
+    leases = open_lease_store(config, DB_FILE)
+    completed = 0
+    try:
+        leases.plan(start_id, end_id, config.get('shard_size', 1000))
+        while True:
+            shard = leases.claim(worker_id)
+            if shard is None:
+                break
+            shard_id, shard_end = shard
+            with LeaseKeeper(leases, worker_id, shard_id, config.get('lease_seconds', 300) / 3) as keeper:
+                try:
+                    load_settled_range(shard_id, shard_end)
+                    profile_ids = [profile_id for profile_id in settled_ids.missing(shard_id, shard_end - shard_id)
+                                   if profile_id < shard_end]
+                    logging.info(f"Worker {worker_id} claimed shard {shard_id}-{shard_end - 1}; {len(profile_ids)} IDs to scrape")
+                    run_profiles(profile_ids, id_range=(shard_id, shard_end))
+                    db.flush()
+                except BaseException:
+                    leases.release(worker_id, shard_id)
+                    raise
+            if keeper.lost.is_set():
+                continue
+            # Failed IDs whose retry was too far off to wait for keep the shard open
+            retry_in = retry_queue.next_due_in(shard_id, shard_end)
+            leases.complete(worker_id, shard_id, retry_in)
+            if retry_in is not None:
+                logging.info(f"Shard {shard_id}-{shard_end - 1} has failed IDs to retry; it can be claimed again in {retry_in:.0f}s")
+                continue
+            completed += 1
+        logging.info(f"Worker {worker_id} completed {completed} shards; no shard left to claim: {leases.stats()['shards']}")
+    finally:
+        leases.close()
 
 # Update main function to include comments fetching and processing
 def main():
-    last_processed_id = get_last_processed_id()
-    profile_ids = fetch_all_profile_ids(last_processed_id + 1)
-    fetch_and_process_profiles(profile_ids)
+    try:
+        if config.get('comments_refresh', False):
+            # Refresh the comments of already processed profiles instead of scraping new ones
+            start_id = config.get('start_id', 1)
+            profile_ids = [profile_id for profile_id in processed_ids if profile_id >= start_id]
+            logging.info(f"Refreshing comments of {len(profile_ids)} processed profiles")
+            run_profiles(profile_ids, refresh_profile, refresh_profile_async)
+        elif config.get('sharded', False):
+            run_shards()
+        elif config.get('id_discovery', False):
+            logging.info(f"{len(processed_ids)} profiles already processed, {len(missing_ids)} IDs known to be missing")
+            discover_profiles()
+        else:
+            profile_ids = fetch_all_profile_ids(config.get('start_id', 1))
+            logging.info(f"{len(processed_ids)} profiles already processed; {len(profile_ids)} IDs scheduled")
+            run_profiles(profile_ids)
+    finally:
+        store.close()
+        db.close()
+        if response_cache:
+            logging.info(f"HTTP cache summary: {response_cache.stats()}")
+            response_cache.close()
+        if proxy_manager:
+            logging.info(f"Proxy summary: {proxy_manager.stats()}")
+            proxy_manager.close()
+        if metrics_exporter:
+            metrics_exporter.close()
+    if concurrency_controller:
+        logging.info(f"Adaptive concurrency summary: {concurrency_controller.stats()}")
 
 if __name__ == "__main__":
     main()
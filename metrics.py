@@ -0,0 +1,307 @@
+import collections
+import logging
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+# A named metric with one value per combination of label values. Instead of being
+# updated, a metric can `track` a function that returns its value (or a dict of
+# label values tuple -> value) whenever the metrics are rendered.
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.func = None
+        self.lock = threading.Lock()
+
+    def track(self, func):
+        self.func = func
+        return self
+
+    def samples(self):
+        if self.func is not None:
+            try:
+                value = self.func()
+            except Exception as e:
+                logging.debug(f"Metric {self.name} could not be collected: {str(e)}")
+                return []
+            items = value.items() if isinstance(value, dict) else [((), value)]
+            return [(self.name, labels, (), value) for labels, value in items]
+        with self.lock:
+            return [(self.name, labels, (), value) for labels, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, extra, value in self.samples():
+            lines.append(f"{name}{format_labels(self.labels, labels, extra)} {value}")
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, labels=()):
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += 1
+            counts[2] += value
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for labels, (buckets, count, total) in self.values.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, buckets):
+                    cumulative += n
+                    samples.append((f"{self.name}_bucket", labels, (('le', bound),), cumulative))
+                samples.append((f"{self.name}_bucket", labels, (('le', '+Inf'),), count))
+                samples.append((f"{self.name}_sum", labels, (), round(total, 6)))
+                samples.append((f"{self.name}_count", labels, (), count))
+        return samples
+
+# Set of metrics of one process. Asking twice for the same name returns the same
+# metric, so modules can declare what they update at import time.
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    # Prometheus text exposition format
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+registry = Registry()
+
+REQUESTS = registry.counter('scraper_requests_total', 'API requests by endpoint and status ("error" for network errors)',
+                            ('endpoint', 'status'))
+REQUEST_DURATION = registry.histogram('scraper_request_duration_seconds', 'API request latency by endpoint', ('endpoint',))
+RESPONSE_BYTES = registry.counter('scraper_response_bytes_total', 'Response body bytes downloaded by endpoint', ('endpoint',))
+
+# Function to turn a URL into a low-cardinality endpoint label: its path with
+# numeric segments replaced by {id}
+def endpoint_of(url):
+    path = urlparse(url).path
+    return re.sub(r'/\d+(?=/|$)', '/{id}', path) or '/'
+
+# Function to record one API request (status None for a network error)
+def observe_request(url, duration, status, size=0):
+    endpoint = endpoint_of(url)
+    REQUESTS.inc((endpoint, 'error' if status is None else str(status)))
+    REQUEST_DURATION.observe(duration, (endpoint,))
+    if size:
+        RESPONSE_BYTES.inc((endpoint,), size)
+
+# Statistical profiler for a running process: every `interval` seconds it records the
+# stack of every thread, so it sees worker threads (which cProfile, enabled in one
+# thread, does not) and costs nothing while not sampling. Stacks are keyed by thread
+# name with the numbers stripped, so the workers of one pool add up.
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+    def run(self, seconds):
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                thread = re.sub(r'\d+', 'N', names.get(ident, 'unknown'))
+                self.stacks[(thread,) + tuple(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+        return self
+
+    # One line per distinct stack, root first, in the format flame graph tools read
+    def collapsed(self):
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    # Functions with the most samples, where they were running (self) and on the stack (total)
+    def top(self, limit=40):
+        own, total = collections.Counter(), collections.Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for frame in set(stack[1:]):
+                total[frame] += count
+        threads = sum(self.stacks.values())
+        lines = [f"{self.samples} samples of {threads} thread stacks", f"{'self':>7} {'total':>7}  function"]
+        for frame, _ in total.most_common(limit):
+            lines.append(f"{own[frame] / threads:7.1%} {total[frame] / threads:7.1%}  {frame}")
+        return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path == '/metrics':
+                body = registry.render()
+                content_type = 'text/plain; version=0.0.4'
+            elif url.path == '/profile':
+                profiler = SamplingProfiler(float(params.get('interval', 0.005))).run(float(params.get('seconds', 10)))
+                body = profiler.collapsed() if params.get('format') == 'collapsed' else profiler.top()
+                content_type = 'text/plain'
+            else:
+                self.send_error(404)
+                return
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+# Publishes the registry while a scraper runs:
+# - on `port`: /metrics for Prometheus and /profile?seconds=N[&format=collapsed]
+#   to sample the running process for N seconds
+# - to `path`, rewritten every `interval` seconds (for node_exporter's textfile collector)
+# - on SIGUSR1 (where available), a `profile_seconds` sample written to `profile_dir`
+class MetricsExporter:
+    def __init__(self, port=0, path=None, interval=15, host='127.0.0.1', profile_seconds=30, profile_dir='data/profiles'):
+        self.path = path
+        self.interval = interval
+        self.profile_seconds = profile_seconds
+        self.profile_dir = profile_dir
+        self.stopped = threading.Event()
+        self.server = None
+        self.writer = None
+        if port:
+            self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True).start()
+            logging.info(f"Serving metrics on http://{host}:{self.server.server_address[1]}/metrics")
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.writer = threading.Thread(target=self._write_periodically, name='metrics-file', daemon=True)
+            self.writer.start()
+        if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.profile_in_background())
+
+    @classmethod
+    def from_config(cls, config, prefix='metrics'):
+        port = config.get(f'{prefix}_port', 0)
+        path = config.get(f'{prefix}_file', '')
+        if not port and not path:
+            return None
+        return cls(
+            port,
+            path,
+            config.get(f'{prefix}_interval', 15),
+            config.get(f'{prefix}_host', '127.0.0.1'),
+            config.get(f'{prefix}_profile_seconds', 30),
+            config.get(f'{prefix}_profile_dir', 'data/profiles')
+        )
+
+    def write(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(registry.render())
+        os.replace(temporary, self.path)
+
+    def _write_periodically(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                logging.error(f"Failed to write metrics to {self.path}: {str(e)}")
+
+    def _profile(self):
+        logging.info(f"Profiling for {self.profile_seconds}s")
+        profiler = SamplingProfiler().run(self.profile_seconds)
+        os.makedirs(self.profile_dir, exist_ok=True)
+        base = os.path.join(self.profile_dir, f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}")
+        with open(f"{base}.txt", 'w') as f:
+            f.write(profiler.top())
+        with open(f"{base}.collapsed", 'w') as f:
+            f.write(profiler.collapsed())
+        logging.info(f"Profile written to {base}.txt and {base}.collapsed")
+
+    def profile_in_background(self):
+        threading.Thread(target=self._profile, name='metrics-profiler', daemon=True).start()
+
+    def close(self):
+        self.stopped.set()
+        if self.writer:
+            self.writer.join()
+            self.write()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
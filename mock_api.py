@@ -0,0 +1,248 @@
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PROFILE_PATH = re.compile(r'^/api/v1/profile/(\d+)$')
+COMMENTS_PATH = re.compile(r'^/api/v1/comments/(\d+)$')
+WIKI_PATH = '/w/api.php'
+
+# Local stand-in for the Personality Database API and the MediaWiki action API,
+# serving synthetic payloads shaped like the real ones:
+# - /api/v1/profile/{id}: a profile, or a 404 for a `missing_rate` share of the IDs
+# - /api/v1/comments/{id}?offset=N: `comment_pages` pages of `comments_per_page` comments
+# - /w/api.php: pages named "Person {id}" (a `wiki_missing_rate` share does not exist)
+#   with `wiki_sections` sections and `wiki_categories` categories, continued like
+#   MediaWiki (one full-text extract or 20 intro extracts per response)
+# Which IDs and pages exist depends only on `seed`, so runs are comparable. Every
+# request waits `latency` seconds (+/- `jitter` of it, or `slow_latency` for a
+# `slow_rate` share), then fails with a 500 at `error_rate` or a 429 carrying
+# Retry-After: `retry_after` at `throttle_rate`.
+class MockApi:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.02, jitter=0.5, slow_rate=0.0, slow_latency=1.0,
+                 error_rate=0.0, throttle_rate=0.0, retry_after=1, missing_rate=0.1, comment_pages=3,
+                 comments_per_page=20, wiki_missing_rate=0.1, wiki_sections=5, wiki_categories=8, seed=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.missing_rate = missing_rate
+        self.comment_pages = comment_pages
+        self.comments_per_page = comments_per_page
+        self.wiki_missing_rate = wiki_missing_rate
+        self.wiki_sections = wiki_sections
+        self.wiki_categories = wiki_categories
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.by_endpoint = {}
+        self.by_status = {}
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.server.server_address[1]}"
+
+    def start(self):
+        self.server = MockServer((self.host, self.port), MockHandler)
+        self.server.api = self
+        threading.Thread(target=self.server.serve_forever, name='mock-api', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'bytes_sent': self.bytes_sent,
+                'by_endpoint': dict(self.by_endpoint),
+                'by_status': {str(status): count for status, count in sorted(self.by_status.items())}
+            }
+
+    # Stable pseudo-random value in [0, 1) for `key`, the same on every run with this seed
+    def chance(self, key):
+        return zlib.crc32(f"{self.seed}:{key}".encode()) / 2 ** 32
+
+    # Function to pick the delay and the injected failure (None, 500 or 429) of one request
+    def draw(self):
+        with self.lock:
+            slow = self.random.random() < self.slow_rate
+            delay = self.slow_latency if slow else self.latency * (1 + self.jitter * (2 * self.random.random() - 1))
+            roll = self.random.random()
+        if roll < self.error_rate:
+            return delay, 500
+        if roll < self.error_rate + self.throttle_rate:
+            return delay, 429
+        return delay, None
+
+    def count(self, endpoint, status, size):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += size
+            self.by_endpoint[endpoint] = self.by_endpoint.get(endpoint, 0) + 1
+            self.by_status[status] = self.by_status.get(status, 0) + 1
+
+    def profile(self, profile_id):
+        if self.chance(f"profile:{profile_id}") < self.missing_rate:
+            return 404, {'error': 'Not found'}
+        votes = [{'personality_type': t, 'theCount': 1 + (profile_id * (i + 3)) % 97}
+                 for i, t in enumerate(('INTJ', 'INFP', 'ENTP', 'ISFJ'))]
+        return 200, {
+            'id': profile_id,
+            'mbti_profile': f"Person {profile_id}",
+            'wiki_description': f"Synthetic profile {profile_id}. " * 8,
+            'subcat_link_info': {'sub_cat_id': profile_id % 50, 'cat_id': profile_id % 12, 'property_id': 1 + profile_id % 2},
+            'total_vote_counts': sum(vote['theCount'] for vote in votes),
+            'breakdown_systems': {'1': votes, '2': votes[:2], '3': []},
+            'functions': [],
+            'systems': [],
+            'mbti_letter_stats': []
+        }
+
+    def comments(self, profile_id, offset):
+        page = offset // max(self.comments_per_page, 1)
+        comments = [{
+            'id': profile_id * 100000 + offset + i,
+            'comment': f"Comment {offset + i} on profile {profile_id}: " + "lorem ipsum " * 10,
+            'create_date': 1700000000 - (offset + i) * 60
+        } for i in range(self.comments_per_page if page < self.comment_pages else 0)]
+        next_offset = offset + len(comments)
+        return 200, {'comments': comments, 'next_offset': next_offset, 'has_more': page + 1 < self.comment_pages}
+
+    def wiki_page(self, title):
+        match = re.match(r'^Person (\d+)$', title)
+        if not match or self.chance(f"wiki:{match.group(1)}") < self.wiki_missing_rate:
+            return None
+        number = int(match.group(1))
+        sections = ''.join(f"\n\n== Section {i} ==\n" + f"Text of section {i} about {title}. " * 12
+                           for i in range(self.wiki_sections))
+        return {
+            'pageid': 1000000 + number,
+            'title': title,
+            'intro': f"{title} is a synthetic page. " * 6,
+            'extract': f"{title} is a synthetic page. " * 6 + sections,
+            'categories': [{'ns': 14, 'title': f"Category:Group {(number + i) % 40}"} for i in range(self.wiki_categories)]
+        }
+
+    # Function to answer an action=query request for the titles it names
+    def wiki_query(self, params):
+        props = params.get('prop', '').split('|')
+        done = params.get('continue', '').strip('|').split('|')
+        query = {}
+        normalized, found, pages = [], [], {}
+        for title in params.get('titles', '').split('|'):
+            name = title.replace('_', ' ').strip()
+            name = name[:1].upper() + name[1:]
+            if name != title:
+                normalized.append({'from': title, 'to': name})
+            page = self.wiki_page(name)
+            if page is None:
+                pages[str(-1 - len(pages))] = {'ns': 0, 'title': name, 'missing': ''}
+            elif str(page['pageid']) not in pages:
+                pages[str(page['pageid'])] = {'pageid': page['pageid'], 'ns': 0, 'title': name}
+                found.append(page)
+        if normalized:
+            query['normalized'] = normalized
+        continuation = {}
+        for page in found:
+            result = pages[str(page['pageid'])]
+            if 'info' in props and 'info' not in done:
+                result.update(contentmodel='wikitext', pagelanguage='en', length=len(page['extract']),
+                              fullurl=f"https://en.wikipedia.org/wiki/{page['title'].replace(' ', '_')}")
+            if 'categories' in props and 'categories' not in done:
+                result['categories'] = page['categories']
+        if 'extracts' in props and 'extracts' not in done:
+            offset = int(params.get('excontinue', 0))
+            per_response = 20 if 'exintro' in params else 1
+            for page in found[offset:offset + per_response]:
+                pages[str(page['pageid'])]['extract'] = page['intro'] if 'exintro' in params else page['extract']
+            if offset + per_response < len(found):
+                finished = [prop for prop in ('info', 'categories') if prop in props]
+                continuation = {'excontinue': offset + per_response, 'continue': '||' + '|'.join(finished)}
+        query['pages'] = pages
+        response = {'batchcomplete': '', 'query': query}
+        if continuation:
+            response = {'continue': continuation, 'query': query}
+        return 200, response
+
+    # Function to route one GET; returns (endpoint, status, payload)
+    def handle(self, path, params):
+        match = PROFILE_PATH.match(path)
+        if match:
+            return ('profile',) + self.profile(int(match.group(1)))
+        match = COMMENTS_PATH.match(path)
+        if match:
+            return ('comments',) + self.comments(int(match.group(1)), int(params.get('offset', 0)))
+        if path == WIKI_PATH:
+            return ('wiki',) + self.wiki_query(params)
+        return 'unknown', 404, {'error': 'Not found'}
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        api = self.server.api
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        delay, failure = api.draw()
+        time.sleep(delay)
+        headers = {}
+        if failure == 429:
+            endpoint, status, payload = 'throttled', 429, {'error': 'Too many requests'}
+            headers['Retry-After'] = str(api.retry_after)
+        elif failure == 500:
+            endpoint, status, payload = 'failed', 500, {'error': 'Internal server error'}
+        else:
+            endpoint, status, payload = api.handle(url.path, params)
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        api.count(endpoint, status, len(body))
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic Personality Database and MediaWiki APIs locally")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--options', default='{}', help="JSON object of MockApi options, e.g. '{\"latency\": 0.05}'")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    api = MockApi(port=args.port, **json.loads(args.options)).start()
+    logging.info(f"Serving on {api.url}; set api_base_url to it and wiki_api_url to {api.url}{WIKI_PATH}")
+    try:
+        while True:
+            time.sleep(60)
+            logging.info(f"Mock API stats: {api.stats()}")
+    except KeyboardInterrupt:
+        api.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from metrics import registry
+
+DB_COMMIT_DURATION = registry.histogram('scraper_db_commit_duration_seconds', 'Time to commit one batch of queued writes')
+DB_ROWS = registry.counter('scraper_db_rows_total', 'Rows committed by the database writer')
+DB_QUEUE_DEPTH = registry.gauge('scraper_db_queue_depth', 'Statements waiting for the database writer')
+
+# Function to open a connection tuned for one writer and many concurrent readers
+def connect(db_file):
+    conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+# Single writer thread draining a queue of statements. Rows are committed in
+# batches of up to `batch_size` queued items, or every `flush_interval` seconds,
+# whichever comes first, so scraper threads never wait on SQLite locks or fsyncs.
+# An item is one statement or a group of statements queued with execute_group,
+# which is always applied or rolled back as a whole.
+class DatabaseWriter:
+    def __init__(self, db_file, batch_size=500, flush_interval=1.0):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.rows_written = 0
+        self.batches = 0
+        self.write_time = 0.0
+        DB_QUEUE_DEPTH.track(self.queue.qsize)
+        self.thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self.thread.start()
+
+    def execute(self, sql, params=()):
+        self.queue.put((sql, params))
+
+    # Function to queue statements that must apply together, as a list of (sql, params)
+    def execute_group(self, statements):
+        if statements:
+            self.queue.put(list(statements))
+
+    # Block until every statement queued so far is committed
+    def flush(self):
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def _run(self):
+        conn = connect(self.db_file)
+        running = True
+        while running:
+            batch, waiters = [], []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+            if batch:
+                self._commit(conn, batch)
+            for waiter in waiters:
+                waiter.set()
+        conn.close()
+
+    # Rows and batches committed so far and the seconds spent writing them
+    def stats(self):
+        return {'rows': self.rows_written, 'batches': self.batches, 'write_time': round(self.write_time, 3)}
+
+    # Function to run queued statements in order, consecutive rows for the same
+    # statement going through executemany
+    def _apply(self, conn, statements):
+        start = 0
+        for end in range(1, len(statements) + 1):
+            if end == len(statements) or statements[end][0] != statements[start][0]:
+                conn.executemany(statements[start][0], [params for _, params in statements[start:end]])
+                start = end
+
+    def _commit(self, conn, batch):
+        started = time.monotonic()
+        items = [item if isinstance(item, list) else [item] for item in batch]
+        try:
+            with conn:
+                self._apply(conn, [statement for statements in items for statement in statements])
+            written = sum(len(statements) for statements in items)
+        except sqlite3.Error as e:
+            logging.error(f"Batch write of {len(batch)} items failed ({str(e)}); retrying item by item")
+            written = 0
+            for statements in items:
+                try:
+                    with conn:
+                        self._apply(conn, statements)
+                    written += len(statements)
+                except sqlite3.Error as e:
+                    logging.error(f"Failed to write {len(statements)} rows starting with {statements[0][1]}: {str(e)}")
+        elapsed = time.monotonic() - started
+        self.rows_written += written
+        self.batches += 1
+        self.write_time += elapsed
+        DB_COMMIT_DURATION.observe(elapsed)
+        DB_ROWS.inc(amount=written)
+
+# Pool of read connections shared between threads
+class ReaderPool:
+    def __init__(self, db_file, size=4):
+        self.db_file = db_file
+        self.connections = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self.connections.put(None)
+
+    @contextmanager
+    def connection(self):
+        conn = self.connections.get()
+        if conn is None:
+            conn = connect(self.db_file)
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+    def close(self):
+        while not self.connections.empty():
+            conn = self.connections.get_nowait()
+            if conn is not None:
+                conn.close()
+
+# Persistence layer shared by main.py and wikipedia.py: queued batched writes and
+# pooled reads against one SQLite file in WAL mode
+class Database:
+    def __init__(self, db_file, batch_size=500, flush_interval=1.0, reader_pool_size=4):
+        self.db_file = db_file
+        self.writer = DatabaseWriter(db_file, batch_size, flush_interval)
+        self.readers = ReaderPool(db_file, reader_pool_size)
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, db_file, config):
+        return cls(
+            db_file,
+            config.get('db_batch_size', 500),
+            config.get('db_flush_interval', 1.0),
+            config.get('db_reader_pool_size', 4)
+        )
+
+    def execute(self, sql, params=()):
+        self.writer.execute(sql, params)
+
+    def execute_group(self, statements):
+        self.writer.execute_group(statements)
+
+    def flush(self):
+        self.writer.flush()
+
+    def stats(self):
+        return self.writer.stats()
+
+    def fetchone(self, sql, params=()):
+        with self.readers.connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        with self.readers.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    # Run schema statements synchronously on a dedicated connection
+    def execute_script(self, script):
+        conn = connect(self.db_file)
+        try:
+            conn.executescript(script)
+        finally:
+            conn.close()
+
+    def close(self):
+        self.writer.close()
+        self.readers.close()
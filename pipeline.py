@@ -0,0 +1,125 @@
+import logging
+import queue
+import threading
+import time
+from metrics import registry
+
+PIPELINE_QUEUE_DEPTH = registry.gauge('scraper_pipeline_queue_depth', 'Items waiting in front of each pipeline stage', ('stage',))
+PIPELINE_BUSY = registry.counter('scraper_pipeline_busy_seconds_total', 'Time pipeline workers spent on items', ('stage',))
+
+# Marks the end of a stage's input
+STOP = object()
+
+# One step of a pipeline: `workers` threads take items from a bounded input queue,
+# call `func(item)` and pass the result on. Returning None drops the item.
+class Stage:
+    def __init__(self, name, func, workers=1, queue_size=100):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.input = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.dropped = 0
+        self.busy = 0.0
+        self.finished_workers = 0
+        self.lock = threading.Lock()
+
+# Runs items through a chain of stages connected by bounded queues. A full queue
+# blocks the stage (or scheduler) in front of it, so a slow stage throttles the
+# whole pipeline instead of piling up work in memory. `on_exit` is called once for
+# every item that leaves the pipeline, whether it completed or was dropped.
+class Pipeline:
+    def __init__(self, stages, on_exit=None, report_interval=10):
+        self.stages = stages
+        self.on_exit = on_exit
+        self.report_interval = report_interval
+        self.started = None
+        self.stopped = threading.Event()
+
+    def _worker(self, index):
+        stage = self.stages[index]
+        downstream = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item = stage.input.get()
+            if item is STOP:
+                break
+            started = time.monotonic()
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                logging.error(f"Unhandled error in {stage.name} stage: {str(e)}")
+                result = None
+            busy = time.monotonic() - started
+            PIPELINE_BUSY.inc((stage.name,), busy)
+            with stage.lock:
+                stage.busy += busy
+                if result is None:
+                    stage.dropped += 1
+                else:
+                    stage.processed += 1
+            if result is not None and downstream is not None:
+                downstream.input.put(result)
+            elif self.on_exit:
+                self.on_exit()
+        # The last worker of a stage to finish shuts down the next stage
+        with stage.lock:
+            stage.finished_workers += 1
+            last = stage.finished_workers == stage.workers
+        if last and downstream is not None:
+            for _ in range(downstream.workers):
+                downstream.input.put(STOP)
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9) if self.started else 1e-9
+        stats = []
+        for stage in self.stages:
+            with stage.lock:
+                stats.append({
+                    'stage': stage.name,
+                    'workers': stage.workers,
+                    'queue_depth': stage.input.qsize(),
+                    'queue_size': stage.input.maxsize,
+                    'processed': stage.processed,
+                    'dropped': stage.dropped,
+                    'throughput': stage.processed / elapsed,
+                    'utilization': stage.busy / (elapsed * stage.workers)
+                })
+        return stats
+
+    def report(self):
+        logging.info("Pipeline: " + " | ".join(
+            f"{s['stage']} q={s['queue_depth']}/{s['queue_size']} {s['throughput']:.1f}/s "
+            f"busy {s['utilization']:.0%} dropped {s['dropped']}"
+            for s in self.stats()))
+
+    def _reporter(self):
+        while not self.stopped.wait(self.report_interval):
+            self.report()
+
+    # Feed `items` into the first stage and block until every stage has drained
+    def run(self, items):
+        self.started = time.monotonic()
+        PIPELINE_QUEUE_DEPTH.track(lambda: {(stage.name,): stage.input.qsize() for stage in self.stages})
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(target=self._worker, args=(index,), name=f'{stage.name}-{n}', daemon=True)
+                thread.start()
+                threads.append(thread)
+        reporter = None
+        if self.report_interval:
+            reporter = threading.Thread(target=self._reporter, name='pipeline-reporter', daemon=True)
+            reporter.start()
+        try:
+            for item in items:
+                self.stages[0].input.put(item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self.stages[0].input.put(STOP)
+            for thread in threads:
+                thread.join()
+            self.stopped.set()
+            if reporter:
+                reporter.join()
+        self.report()
+        return self.stats()
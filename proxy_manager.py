@@ -0,0 +1,196 @@
+import logging
+import threading
+import time
+import requests
+from metrics import registry
+
+PROXY_FAILURES = registry.counter('scraper_proxy_failures_total', 'Requests that failed because of the proxy')
+PROXY_EVICTIONS = registry.counter('scraper_proxy_evictions_total', 'Proxies evicted for failing')
+HEALTHY_PROXIES = registry.gauge('scraper_proxies_healthy', 'Healthy proxies on hand')
+
+# Statuses that point at the proxy rather than the API: auth/ban pages and gateway
+# errors. A 429 is the API throttling the scraper, which the rate limiter and the
+# concurrency controller deal with; it says nothing about the proxy.
+PROXY_ERROR_STATUSES = (403, 407)
+
+# Function to tell whether a request outcome (status None for a network error) counts against the proxy
+def is_proxy_failure(status):
+    return status is None or status in PROXY_ERROR_STATUSES or status >= 500
+
+# Health of one proxy: exponentially weighted latency and error rate, the number
+# of requests in flight through it and the current run of consecutive failures
+class ProxyStats:
+    def __init__(self, address):
+        self.address = address
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.session = None
+
+    # Expected time for a new request: latency scaled by the requests already queued
+    # on the proxy and by its failure rate. Unmeasured proxies are tried first.
+    def score(self):
+        if self.latency is None:
+            return (0, self.in_flight)
+        return (1, self.latency * (1 + self.in_flight) / max(1 - self.error_rate, 0.05))
+
+# Pool of proxies shared by all workers. A background thread keeps `buffer_size`
+# healthy proxies on hand by calling `fetch_proxy` (which returns one proxy address
+# or None), so the proxy pool service is off the per-profile path. Proxies are reused
+# for many requests, each through its own keep-alive session, and every request goes
+# to the best scoring proxy at the time it is sent. A proxy is evicted after
+# `max_consecutive_failures` failures in a row, or once it has served `min_requests`
+# requests with an error rate above `max_error_rate`; evicted proxies are never
+# handed out again.
+class ProxyManager:
+    def __init__(self, fetch_proxy, buffer_size=10, max_error_rate=0.3, min_requests=5,
+                 max_consecutive_failures=3, acquire_timeout=30, request_timeout=30,
+                 refill_interval=1.0, smoothing=0.2):
+        self.fetch_proxy = fetch_proxy
+        self.buffer_size = max(1, buffer_size)
+        self.max_error_rate = max_error_rate
+        self.min_requests = min_requests
+        self.max_consecutive_failures = max_consecutive_failures
+        self.acquire_timeout = acquire_timeout
+        self.request_timeout = request_timeout
+        self.refill_interval = refill_interval
+        self.smoothing = smoothing
+        self.proxies = {}
+        self.evicted = set()
+        self.untracked_sessions = {}
+        self.fetched = 0
+        self.duplicates = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+        HEALTHY_PROXIES.track(lambda: len(self.proxies))
+        self.thread = threading.Thread(target=self._prefetch, name='proxy-prefetch', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def from_config(cls, config, fetch_proxy):
+        return cls(
+            fetch_proxy,
+            config.get('proxy_buffer_size', 10),
+            config.get('proxy_max_error_rate', 0.3),
+            config.get('proxy_min_requests', 5),
+            config.get('proxy_max_consecutive_failures', 3),
+            config.get('proxy_acquire_timeout', 30),
+            config.get('proxy_request_timeout', 30)
+        )
+
+    def _prefetch(self):
+        while True:
+            with self.condition:
+                while not self.stopped and len(self.proxies) >= self.buffer_size:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+            try:
+                address = self.fetch_proxy()
+            except Exception as e:
+                logging.error(f"Failed to fetch proxy: {str(e)}")
+                address = None
+            with self.condition:
+                if address and address not in self.proxies and address not in self.evicted:
+                    self.proxies[address] = ProxyStats(address)
+                    self.fetched += 1
+                    self.condition.notify_all()
+                    continue
+                if address:
+                    self.duplicates += 1
+                # Nothing new from the pool service; ask again a little later
+                self.condition.wait(self.refill_interval)
+
+    # Function to pick the best healthy proxy other than `exclude`, waiting up to
+    # `timeout` seconds (default acquire_timeout) for the prefetcher if there is none.
+    # With `reserve` the request is counted in flight until record() is called.
+    def acquire(self, exclude=None, timeout=None, reserve=True):
+        deadline = time.monotonic() + (self.acquire_timeout if timeout is None else timeout)
+        with self.condition:
+            while True:
+                candidates = [stats for address, stats in self.proxies.items() if address != exclude]
+                if candidates:
+                    best = min(candidates, key=ProxyStats.score)
+                    if reserve:
+                        best.in_flight += 1
+                    return best.address
+                remaining = deadline - time.monotonic()
+                if self.stopped or remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    # Keep-alive session routed through `address`. A proxy evicted between acquire()
+    # and this call gets one session of its own, reused until close().
+    def session(self, address):
+        with self.condition:
+            stats = self.proxies.get(address)
+            if stats is not None:
+                if stats.session is None:
+                    stats.session = self._new_session(address)
+                return stats.session
+            session = self.untracked_sessions.get(address)
+            if session is None:
+                session = self.untracked_sessions[address] = self._new_session(address)
+            return session
+
+    @staticmethod
+    def _new_session(address):
+        session = requests.Session()
+        session.proxies = {"http": f"http://{address}", "https": f"http://{address}"}
+        return session
+
+    # Record the outcome of a request sent through `address` (status None for a network error)
+    def record(self, address, latency, status):
+        with self.condition:
+            stats = self.proxies.get(address)
+            if stats is None:
+                return
+            stats.in_flight = max(stats.in_flight - 1, 0)
+            if status == 429:
+                return
+            stats.requests += 1
+            failed = is_proxy_failure(status)
+            stats.error_rate += self.smoothing * ((1.0 if failed else 0.0) - stats.error_rate)
+            if failed:
+                stats.failures += 1
+                PROXY_FAILURES.inc()
+            else:
+                stats.failures = 0
+                stats.latency = latency if stats.latency is None else stats.latency + self.smoothing * (latency - stats.latency)
+            if stats.failures >= self.max_consecutive_failures:
+                self._evict(address, f"{stats.failures} consecutive failures")
+            elif stats.requests >= self.min_requests and stats.error_rate > self.max_error_rate:
+                self._evict(address, f"error rate {stats.error_rate:.0%}")
+
+    def _evict(self, address, reason):
+        stats = self.proxies.pop(address)
+        if stats.session is not None:
+            stats.session.close()
+        self.evicted.add(address)
+        PROXY_EVICTIONS.inc()
+        logging.info(f"Evicted proxy {address} ({reason}); {len(self.proxies)} healthy proxies left")
+        self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            ranked = sorted(self.proxies.values(), key=ProxyStats.score)
+            return {
+                'healthy': len(self.proxies),
+                'evicted': len(self.evicted),
+                'fetched': self.fetched,
+                'duplicates': self.duplicates,
+                'best': [(stats.address, stats.latency, round(stats.error_rate, 3)) for stats in ranked[:3]]
+            }
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+            sessions = [stats.session for stats in self.proxies.values() if stats.session is not None]
+            sessions.extend(self.untracked_sessions.values())
+            self.untracked_sessions.clear()
+        self.thread.join(timeout=self.refill_interval + 1)
+        for session in sessions:
+            session.close()
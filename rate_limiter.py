@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from metrics import registry
+
+RATE_LIMIT_WAIT = registry.counter('scraper_rate_limit_wait_seconds_total', 'Time requests spent waiting for the rate limiter')
+RATE_LIMIT_PAUSES = registry.counter('scraper_rate_limit_pauses_total', 'Pauses of all requests after a 429 or 503', ('status',))
+
+# Token bucket refilled at `rate` tokens per second, holding at most `burst` tokens.
+# Callers reserve a token up front and sleep for the returned delay, so the same
+# bucket serves both worker threads and asyncio coroutines.
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(max(burst, 1))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+# Function to turn a Retry-After header (seconds or HTTP date) into a delay in seconds
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+# Shared limiter for every outgoing request of a scraper. Buckets are kept per key
+# ('global', per host or per proxy) and a 429/503 response pauses all of them.
+class RateLimiter:
+    def __init__(self, requests_per_second, burst, key_by='global', default_backoff=30):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.key_by = key_by
+        self.default_backoff = default_backoff
+        self.buckets = {}
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, prefix='rate_limit'):
+        return cls(
+            config.get(f'{prefix}_per_second', 5),
+            config.get(f'{prefix}_burst', 10),
+            config.get(f'{prefix}_key', 'global'),
+            config.get(f'{prefix}_backoff', 30)
+        )
+
+    def _key(self, url, proxy):
+        if self.key_by == 'host' and url:
+            return urlparse(url).netloc
+        if self.key_by == 'proxy':
+            return proxy or 'direct'
+        return 'global'
+
+    def _bucket(self, key):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.requests_per_second, self.burst)
+            return bucket
+
+    def _blocked_for(self):
+        return self.blocked_until - time.monotonic()
+
+    # Block the calling thread until a request to `url` may be sent
+    def wait(self, url=None, proxy=None):
+        if self.requests_per_second <= 0:
+            return
+        # Read the pause once per pass: it can run out between a check and the sleep
+        blocked = self._blocked_for()
+        while blocked > 0:
+            RATE_LIMIT_WAIT.inc(amount=blocked)
+            time.sleep(blocked)
+            blocked = self._blocked_for()
+        delay = self._bucket(self._key(url, proxy)).reserve()
+        if delay > 0:
+            RATE_LIMIT_WAIT.inc(amount=delay)
+            time.sleep(delay)
+
+    # Async variant of wait
+    async def wait_async(self, url=None, proxy=None):
+        if self.requests_per_second <= 0:
+            return
+        blocked = self._blocked_for()
+        while blocked > 0:
+            RATE_LIMIT_WAIT.inc(amount=blocked)
+            await asyncio.sleep(blocked)
+            blocked = self._blocked_for()
+        delay = self._bucket(self._key(url, proxy)).reserve()
+        if delay > 0:
+            RATE_LIMIT_WAIT.inc(amount=delay)
+            await asyncio.sleep(delay)
+
+    # Pause every bucket when the upstream tells us to slow down
+    def record_response(self, status_code, headers=None):
+        if status_code not in (429, 503):
+            return
+        retry_after = parse_retry_after((headers or {}).get('Retry-After'))
+        if retry_after is None:
+            if status_code == 503:
+                return
+            retry_after = self.default_backoff
+        with self.lock:
+            until = time.monotonic() + retry_after
+            if until > self.blocked_until:
+                self.blocked_until = until
+                RATE_LIMIT_PAUSES.inc((str(status_code),))
+                logging.warning(f"Received status {status_code}; pausing all requests for {retry_after:.1f}s")
+
+    # requests response hook, for sessions owned by third-party clients
+    def response_hook(self, response, *args, **kwargs):
+        self.record_response(response.status_code, response.headers)
@@ -0,0 +1,406 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import struct
+import threading
+import zlib
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Record kinds and where the JSON backend keeps them
+DEFAULT_DIRS = {
+    'typing': 'data/typing',
+    'comments': 'data/comments',
+    'wiki': 'data/wiki'
+}
+
+# json.dump options the scrapers have always used for each kind
+JSON_FORMATS = {
+    'typing': {'indent': 2},
+    'comments': {'indent': 2},
+    'wiki': {'indent': 4, 'ensure_ascii': False}
+}
+
+# One JSON file per record: {dir}/{profile_id}_{kind}.json. Records built page by
+# page with append() go to {dir}/{profile_id}_{kind}.jsonl, one item per line.
+class JsonFileStore:
+    def __init__(self, dirs=None):
+        self.dirs = dict(DEFAULT_DIRS, **(dirs or {}))
+
+    def path(self, kind, profile_id):
+        return Path(self.dirs[kind]) / f'{profile_id}_{kind}.json'
+
+    def stream_path(self, kind, profile_id):
+        return Path(self.dirs[kind]) / f'{profile_id}_{kind}.jsonl'
+
+    def write(self, kind, profile_id, data):
+        file_path = self.path(kind, profile_id)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, **JSON_FORMATS.get(kind, {}))
+        self.stream_path(kind, profile_id).unlink(missing_ok=True)
+
+    def read(self, kind, profile_id):
+        if self.stream_path(kind, profile_id).exists():
+            return list(self.read_items(kind, profile_id))
+        try:
+            with open(self.path(kind, profile_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    # Append a list of items to a record; returns the position to truncate back to
+    def append(self, kind, profile_id, items):
+        file_path = self.stream_path(kind, profile_id)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(file_path, 'a', encoding='utf-8') as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+            return f.tell()
+
+    # Drop everything appended after `position`
+    def truncate(self, kind, profile_id, position):
+        file_path = self.stream_path(kind, profile_id)
+        if file_path.exists() and file_path.stat().st_size > position:
+            os.truncate(file_path, position)
+
+    # Iterate over the items of a record without loading it whole when it was appended
+    def read_items(self, kind, profile_id):
+        file_path = self.stream_path(kind, profile_id)
+        if not file_path.exists():
+            yield from self.read(kind, profile_id) or []
+            return
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def ids(self, kind):
+        pattern = re.compile(rf'^(\d+)_{kind}\.jsonl?$')
+        if not os.path.isdir(self.dirs[kind]):
+            return []
+        return sorted({int(m.group(1)) for m in map(pattern.match, os.listdir(self.dirs[kind])) if m})
+
+    # Change token per record (file mtime and size), taken from one directory scan
+    def versions(self, kind):
+        pattern = re.compile(rf'^(\d+)_{kind}\.json(l?)$')
+        if not os.path.isdir(self.dirs[kind]):
+            return {}
+        versions, streamed = {}, {}
+        with os.scandir(self.dirs[kind]) as entries:
+            for entry in entries:
+                m = pattern.match(entry.name)
+                if m:
+                    stat = entry.stat()
+                    token = f'{stat.st_mtime_ns}:{stat.st_size}'
+                    (streamed if m.group(2) else versions)[int(m.group(1))] = token
+        # Like read(), an appended .jsonl record takes precedence
+        versions.update({profile_id: f'l{token}' for profile_id, token in streamed.items()})
+        return versions
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+# Record header: payload length, profile ID, codec (high bit set for appended chunks)
+HEADER = struct.Struct('<IqB')
+CODEC_NONE, CODEC_ZLIB, CODEC_ZSTD = 0, 1, 2
+CHUNK_FLAG = 0x80
+CODECS = {None: CODEC_NONE, 'none': CODEC_NONE, 'zlib': CODEC_ZLIB, 'gzip': CODEC_ZLIB, 'zstd': CODEC_ZSTD}
+
+def encode_payload(data, codec):
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if codec == CODEC_ZLIB:
+        return zlib.compress(payload, 6)
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(payload)
+    return payload
+
+def decode_payload(payload, codec):
+    codec &= ~CHUNK_FLAG
+    if codec == CODEC_ZLIB:
+        payload = zlib.decompress(payload)
+    elif codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed records")
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+    return json.loads(payload)
+
+# Append-only segment files sharded by profile ID:
+#   {root}/{kind}/shard-{nn}/segment-{nnnnnn}.seg
+# Each record is a HEADER followed by its (optionally compressed) JSON payload.
+# index.db maps (kind, profile_id) to the newest record's location; records
+# built with append() are stored as numbered chunks instead. Every record reaches
+# the segment file and the index before write() or append() returns, so whatever a
+# caller marks as done afterwards survives the process being killed. The index can
+# be rebuilt from the segments with rebuild_index(). Only one process may write a
+# given kind at a time.
+class SegmentStore:
+    def __init__(self, root, shards=16, compression='zlib', max_segment_bytes=256 * 1024 * 1024):
+        if compression not in CODECS:
+            raise ValueError(f"Unknown segment compression '{compression}'")
+        if CODECS[compression] == CODEC_ZSTD and zstandard is None:
+            raise ValueError("segment_compression 'zstd' requires the zstandard package")
+        self.root = Path(root)
+        self.shards = shards
+        self.codec = CODECS[compression]
+        self.max_segment_bytes = max_segment_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index = sqlite3.connect(self.root / 'index.db', timeout=30, check_same_thread=False)
+        self.index.execute('PRAGMA journal_mode=WAL')
+        self.index.execute('PRAGMA synchronous=NORMAL')
+        self.index.execute('''
+            CREATE TABLE IF NOT EXISTS records (
+                kind TEXT,
+                profile_id INTEGER,
+                segment TEXT,
+                offset INTEGER,
+                length INTEGER,
+                PRIMARY KEY (kind, profile_id)
+            ) WITHOUT ROWID
+        ''')
+        self.index.execute('''
+            CREATE TABLE IF NOT EXISTS chunks (
+                kind TEXT,
+                profile_id INTEGER,
+                seq INTEGER,
+                segment TEXT,
+                offset INTEGER,
+                length INTEGER,
+                PRIMARY KEY (kind, profile_id, seq)
+            ) WITHOUT ROWID
+        ''')
+        self.index.commit()
+        self.index_lock = threading.Lock()
+        self.writers = {}
+        self.writer_locks = {}
+        self.readers = {}
+        self.lock = threading.Lock()
+
+    def _shard_lock(self, kind, shard):
+        with self.lock:
+            return self.writer_locks.setdefault((kind, shard), threading.Lock())
+
+    # Open (or roll over) the segment a shard is currently appending to
+    def _writer(self, kind, shard, incoming_bytes):
+        writer = self.writers.get((kind, shard))
+        if writer is None:
+            shard_dir = self.root / kind / f'shard-{shard:02d}'
+            shard_dir.mkdir(parents=True, exist_ok=True)
+            segments = sorted(shard_dir.glob('segment-*.seg'))
+            seq = int(segments[-1].stem.split('-')[1]) if segments else 0
+            writer = self._open_segment(kind, shard, seq)
+        if writer['offset'] and writer['offset'] + incoming_bytes > self.max_segment_bytes:
+            writer['file'].close()
+            writer = self._open_segment(kind, shard, writer['seq'] + 1)
+        return writer
+
+    def _open_segment(self, kind, shard, seq):
+        relative = f'{kind}/shard-{shard:02d}/segment-{seq:06d}.seg'
+        f = open(self.root / relative, 'ab')
+        writer = {'file': f, 'seq': seq, 'segment': relative, 'offset': f.tell()}
+        self.writers[(kind, shard)] = writer
+        return writer
+
+    def _append_record(self, kind, profile_id, data, flags=0):
+        payload = encode_payload(data, self.codec)
+        record = HEADER.pack(len(payload), profile_id, self.codec | flags) + payload
+        shard = profile_id % self.shards
+        with self._shard_lock(kind, shard):
+            writer = self._writer(kind, shard, len(record))
+            offset = writer['offset']
+            writer['file'].write(record)
+            # Segment data must reach the OS before the index points at it
+            writer['file'].flush()
+            writer['offset'] += len(record)
+            return writer['segment'], offset, len(record)
+
+    def write(self, kind, profile_id, data):
+        location = self._append_record(kind, profile_id, data)
+        with self.index_lock:
+            self.index.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)', (kind, profile_id) + location)
+            self.index.execute('DELETE FROM chunks WHERE kind = ? AND profile_id = ?', (kind, profile_id))
+            self.index.commit()
+
+    # Append a list of items to a record as a new chunk; returns the chunk count
+    # to truncate back to. Chunks are indexed immediately so a caller's checkpoint
+    # never points past what is on disk.
+    def append(self, kind, profile_id, items):
+        with self.index_lock:
+            seq = self.index.execute('SELECT COUNT(*) FROM chunks WHERE kind = ? AND profile_id = ?',
+                                     (kind, profile_id)).fetchone()[0]
+        location = self._append_record(kind, profile_id, {'seq': seq, 'items': items}, CHUNK_FLAG)
+        with self.index_lock:
+            self.index.execute('INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?)',
+                               (kind, profile_id, seq) + location)
+            self.index.commit()
+        return seq + 1
+
+    # Drop every chunk appended after `position`
+    def truncate(self, kind, profile_id, position):
+        with self.index_lock:
+            self.index.execute('DELETE FROM chunks WHERE kind = ? AND profile_id = ? AND seq >= ?',
+                               (kind, profile_id, position))
+            self.index.commit()
+
+    def read(self, kind, profile_id):
+        with self.index_lock:
+            has_chunks = self.index.execute('SELECT 1 FROM chunks WHERE kind = ? AND profile_id = ? LIMIT 1',
+                                            (kind, profile_id)).fetchone()
+            row = self.index.execute('SELECT segment, offset, length FROM records WHERE kind = ? AND profile_id = ?',
+                                     (kind, profile_id)).fetchone()
+        if has_chunks:
+            return list(self.read_items(kind, profile_id))
+        if row is None:
+            return None
+        return self._read_record(kind, profile_id, *row)
+
+    # Iterate over the items of a record, one chunk in memory at a time
+    def read_items(self, kind, profile_id):
+        with self.index_lock:
+            rows = self.index.execute('SELECT segment, offset, length FROM chunks WHERE kind = ? AND profile_id = ? ORDER BY seq',
+                                      (kind, profile_id)).fetchall()
+        if not rows:
+            yield from self.read(kind, profile_id) or []
+            return
+        for row in rows:
+            yield from self._read_record(kind, profile_id, *row)['items']
+
+    def _read_record(self, kind, profile_id, segment, offset, length):
+        with self.lock:
+            reader = self.readers.get(segment)
+            if reader is None:
+                reader = self.readers[segment] = (open(self.root / segment, 'rb'), threading.Lock())
+        f, reader_lock = reader
+        with reader_lock:
+            f.seek(offset)
+            record = f.read(length)
+        payload_length, _, codec = HEADER.unpack_from(record)
+        return decode_payload(record[HEADER.size:HEADER.size + payload_length], codec)
+
+    def ids(self, kind):
+        with self.index_lock:
+            return [row[0] for row in self.index.execute('''
+                SELECT profile_id FROM records WHERE kind = ?
+                UNION
+                SELECT profile_id FROM chunks WHERE kind = ?
+                ORDER BY profile_id
+            ''', (kind, kind))]
+
+    # Change token per record: the location of its newest copy, or a digest of its chunks
+    def versions(self, kind):
+        with self.index_lock:
+            versions = {profile_id: f'{segment}:{offset}' for profile_id, segment, offset in self.index.execute(
+                'SELECT profile_id, segment, offset FROM records WHERE kind = ?', (kind,))}
+            for profile_id, count, total, segment in self.index.execute('''
+                SELECT profile_id, COUNT(*), SUM(offset), MAX(segment) FROM chunks WHERE kind = ? GROUP BY profile_id
+            ''', (kind,)):
+                versions[profile_id] = f'c{count}:{total}:{segment}'
+            return versions
+
+    # Re-create index.db by scanning every segment; later records win. A full
+    # record drops the chunks written before it, as write() does. Chunks dropped by
+    # truncate() and never re-appended come back after a rebuild.
+    def rebuild_index(self):
+        with self.index_lock:
+            records, chunks = {}, {}
+            # A profile's records all go to one shard, whose segments sort in write order
+            for segment_path in sorted(self.root.glob('*/shard-*/segment-*.seg')):
+                relative = segment_path.relative_to(self.root).as_posix()
+                kind = relative.split('/')[0]
+                with open(segment_path, 'rb') as f:
+                    offset = 0
+                    while True:
+                        header = f.read(HEADER.size)
+                        if len(header) < HEADER.size:
+                            break
+                        payload_length, profile_id, codec = HEADER.unpack(header)
+                        location = (relative, offset, HEADER.size + payload_length)
+                        if codec & CHUNK_FLAG:
+                            seq = decode_payload(f.read(payload_length), codec)['seq']
+                            chunks.setdefault((kind, profile_id), {})[seq] = location
+                        else:
+                            f.seek(payload_length, os.SEEK_CUR)
+                            records[(kind, profile_id)] = location
+                            chunks.pop((kind, profile_id), None)
+                        offset += HEADER.size + payload_length
+            self.index.execute('DELETE FROM records')
+            self.index.execute('DELETE FROM chunks')
+            self.index.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?)',
+                                   [key + location for key, location in records.items()])
+            self.index.executemany('INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?)',
+                                   [key + (seq,) + location for key, seqs in chunks.items()
+                                    for seq, location in seqs.items()])
+            self.index.commit()
+
+    def flush(self):
+        with self.index_lock:
+            self.index.commit()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            for writer in self.writers.values():
+                writer['file'].close()
+            for f, _ in self.readers.values():
+                f.close()
+            self.writers.clear()
+            self.readers.clear()
+        self.index.close()
+
+# Function to open the storage backend selected in config.json
+def open_store(config, dirs=None):
+    if config.get('storage_backend', 'json') == 'segments':
+        return SegmentStore(
+            config.get('segment_dir', 'data/segments'),
+            config.get('segment_shards', 16),
+            config.get('segment_compression', 'zlib'),
+            config.get('segment_max_bytes', 256 * 1024 * 1024)
+        )
+    return JsonFileStore(dirs)
+
+# Function to copy every record of the given kinds from one store into another
+def migrate(source, target, kinds=tuple(DEFAULT_DIRS)):
+    for kind in kinds:
+        ids = source.ids(kind)
+        logging.info(f"Migrating {len(ids)} {kind} records")
+        for profile_id in ids:
+            data = source.read(kind, profile_id)
+            if data is not None:
+                target.write(kind, profile_id, data)
+    target.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the segment record store")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help="Copy JSON files into segments")
+    migrate_parser.add_argument('--typing-dir', default=DEFAULT_DIRS['typing'])
+    migrate_parser.add_argument('--comments-dir', default=DEFAULT_DIRS['comments'])
+    migrate_parser.add_argument('--wiki-dir', default=DEFAULT_DIRS['wiki'])
+    migrate_parser.add_argument('--kinds', nargs='+', default=list(DEFAULT_DIRS), choices=list(DEFAULT_DIRS))
+    subparsers.add_parser('reindex', help="Rebuild index.db from the segment files")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with open('config.json') as f:
+        config = json.load(f)
+    target = open_store(dict(config, storage_backend='segments'))
+    try:
+        if args.command == 'migrate':
+            source = JsonFileStore({'typing': args.typing_dir, 'comments': args.comments_dir, 'wiki': args.wiki_dir})
+            migrate(source, target, args.kinds)
+        else:
+            target.rebuild_index()
+    finally:
+        target.close()
+
+if __name__ == "__main__":
+    main()
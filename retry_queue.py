@@ -0,0 +1,196 @@
+import argparse
+import heapq
+import logging
+import random
+import threading
+import time
+from metrics import registry
+from persistence import connect
+
+# Profiles whose last attempt failed, with the time of their next attempt, and the
+# profiles that failed too often to be tried again (dead letters)
+RETRY_TABLES = '''
+    CREATE TABLE IF NOT EXISTS retry_queue (
+        id INTEGER PRIMARY KEY,
+        category TEXT,
+        attempts INTEGER,
+        next_attempt_at REAL,
+        last_error TEXT
+    );
+    CREATE TABLE IF NOT EXISTS dead_letters (
+        id INTEGER PRIMARY KEY,
+        category TEXT,
+        attempts INTEGER,
+        last_error TEXT,
+        failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+# Failures that usually go away on their own; the others (parse errors, other 4xx,
+# unexpected exceptions) are given fewer attempts
+TRANSIENT_CATEGORIES = ('network', 'server', 'throttled')
+
+RETRIES = registry.counter('scraper_retries_total', 'Failed attempts by category, scheduled for a retry or dead-lettered',
+                           ('category', 'outcome'))
+
+# Function to classify a failed HTTP status
+def classify_status(status):
+    if status == 429:
+        return 'throttled'
+    if status == 404:
+        return 'not_found'
+    if status >= 500:
+        return 'server'
+    return 'client'
+
+# Persistent retry schedule. Each failure of a profile pushes its next attempt back
+# exponentially (`base_delay` * 2^(attempts-1), capped at `max_delay`, shortened by
+# up to `jitter` at random so retries do not come back in lockstep). After
+# `max_attempts` transient or `max_attempts_nontransient` other failures the
+# profile moves to dead_letters and is not scheduled again. The schedule is kept in
+# memory and mirrored to the database through the batching writer.
+class RetryQueue:
+    def __init__(self, db, base_delay=30, max_delay=3600, jitter=0.5, max_attempts=5, max_attempts_nontransient=2):
+        self.db = db
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+        self.max_attempts_nontransient = max_attempts_nontransient
+        self.entries = {}
+        self.heap = []
+        self.dead = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, db, config):
+        return cls(
+            db,
+            config.get('retry_base_delay', 30),
+            config.get('retry_max_delay', 3600),
+            config.get('retry_jitter', 0.5),
+            config.get('retry_max_attempts', 5),
+            config.get('retry_max_attempts_nontransient', 2)
+        )
+
+    # Function to load the stored schedule, or only [start_id, end_id) (e.g. to pick up
+    # what other workers recorded for a shard); entries already known are kept.
+    # Returns the dead-lettered IDs read.
+    def load(self, start_id=None, end_id=None):
+        where, params = ('WHERE id >= ? AND id < ?', (start_id, end_id)) if start_id is not None else ('', ())
+        with self.lock:
+            for profile_id, attempts, next_attempt_at in self.db.fetchall(
+                    f'SELECT id, attempts, next_attempt_at FROM retry_queue {where}', params):
+                if profile_id not in self.entries:
+                    self.entries[profile_id] = (attempts, next_attempt_at)
+                    heapq.heappush(self.heap, (next_attempt_at, profile_id))
+            dead = [profile_id for (profile_id,) in self.db.fetchall(f'SELECT id FROM dead_letters {where}', params)]
+            self.dead.update(dead)
+        return dead
+
+    def __contains__(self, profile_id):
+        return profile_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def backoff(self, attempts):
+        delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+        return delay * (1 - self.jitter * random.random())
+
+    # Function to record a failed attempt; returns the delay until the next attempt,
+    # or None if the profile was moved to the dead letters
+    def record_failure(self, profile_id, category, error_message):
+        limit = self.max_attempts if category in TRANSIENT_CATEGORIES else self.max_attempts_nontransient
+        with self.lock:
+            attempts = self.entries.get(profile_id, (0, None))[0] + 1
+            if attempts >= limit:
+                self.entries.pop(profile_id, None)
+                self.dead.add(profile_id)
+                self.db.execute('DELETE FROM retry_queue WHERE id = ?', (profile_id,))
+                self.db.execute('''
+                    INSERT OR REPLACE INTO dead_letters (id, category, attempts, last_error) VALUES (?, ?, ?, ?)
+                ''', (profile_id, category, attempts, error_message))
+                RETRIES.inc((category, 'dead'))
+                return None
+            delay = self.backoff(attempts)
+            next_attempt_at = time.time() + delay
+            self.entries[profile_id] = (attempts, next_attempt_at)
+            heapq.heappush(self.heap, (next_attempt_at, profile_id))
+            self.db.execute('''
+                INSERT OR REPLACE INTO retry_queue (id, category, attempts, next_attempt_at, last_error)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (profile_id, category, attempts, next_attempt_at, error_message))
+            RETRIES.inc((category, 'scheduled'))
+            return delay
+
+    # Function to drop a profile from the schedule once it has a final outcome
+    def resolve(self, profile_id):
+        with self.lock:
+            if self.entries.pop(profile_id, None) is not None:
+                self.db.execute('DELETE FROM retry_queue WHERE id = ?', (profile_id,))
+
+    # Function to take the profiles whose next attempt is due, optionally only those
+    # in [start_id, end_id)
+    def due(self, start_id=None, end_id=None):
+        now = time.time()
+        due, later = [], []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                next_attempt_at, profile_id = heapq.heappop(self.heap)
+                entry = self.entries.get(profile_id)
+                if entry is None or entry[1] != next_attempt_at:
+                    continue  # resolved, or rescheduled with a newer entry
+                if start_id is not None and not start_id <= profile_id < end_id:
+                    later.append((next_attempt_at, profile_id))
+                    continue
+                due.append(profile_id)
+            for item in later:
+                heapq.heappush(self.heap, item)
+        return sorted(due)
+
+    # Seconds until the next scheduled attempt (in [start_id, end_id) if given), or None.
+    # Profiles taken by `due` that ended without an outcome (e.g. no proxy was available)
+    # stay in the table for the next run but are not waited for.
+    def next_due_in(self, start_id=None, end_id=None):
+        with self.lock:
+            times = [next_attempt_at for next_attempt_at, profile_id in self.heap
+                     if self.entries.get(profile_id, (0, None))[1] == next_attempt_at
+                     and (start_id is None or start_id <= profile_id < end_id)]
+        return max(min(times) - time.time(), 0.0) if times else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the retry queue and dead letters")
+    parser.add_argument('--db', default='personality_profiles.db')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help="Count scheduled retries and dead letters by category")
+    requeue_parser = subparsers.add_parser('requeue', help="Move dead letters back to the retry queue, due now")
+    requeue_parser.add_argument('--category', help="Only dead letters of this category")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    conn = connect(args.db)
+    try:
+        conn.executescript(RETRY_TABLES)
+        if args.command == 'requeue':
+            where, params = ('WHERE category = ?', (args.category,)) if args.category else ('', ())
+            with conn:
+                conn.execute(f'''
+                    INSERT OR REPLACE INTO retry_queue (id, category, attempts, next_attempt_at, last_error)
+                    SELECT id, category, 0, 0, last_error FROM dead_letters {where}
+                ''', params)
+                count = conn.execute(f'DELETE FROM dead_letters {where}', params).rowcount
+            logging.info(f"Requeued {count} dead letters")
+            return
+        now = time.time()
+        for category, count, due in conn.execute('''
+            SELECT category, COUNT(*), SUM(next_attempt_at <= ?) FROM retry_queue GROUP BY category ORDER BY category
+        ''', (now,)):
+            print(f"retry  {category:10} {count:8} ({due} due)")
+        for category, count in conn.execute('SELECT category, COUNT(*) FROM dead_letters GROUP BY category ORDER BY category'):
+            print(f"dead   {category:10} {count:8}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import json
+import logging
+import sqlite3
+from tqdm import tqdm
+from persistence import Database, connect
+from record_store import open_store
+
+# Full-text search over comment bodies and wiki summaries/sections. search_documents
+# holds one row per comment or wiki section; search_index is an FTS5 index over it
+# (external content), kept in sync by triggers so that replacing a profile's
+# documents is one DELETE plus INSERTs through the database writer.
+SEARCH_TABLES = '''
+    CREATE TABLE IF NOT EXISTS search_documents (
+        id INTEGER PRIMARY KEY,
+        kind TEXT,
+        profile_id INTEGER,
+        item_id TEXT,
+        title TEXT,
+        body TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_search_documents_profile ON search_documents (kind, profile_id);
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title, body, content='search_documents', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    );
+    CREATE TRIGGER IF NOT EXISTS search_documents_insert AFTER INSERT ON search_documents BEGIN
+        INSERT INTO search_index (rowid, title, body) VALUES (new.id, new.title, new.body);
+    END;
+    CREATE TRIGGER IF NOT EXISTS search_documents_delete AFTER DELETE ON search_documents BEGIN
+        INSERT INTO search_index (search_index, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END;
+'''
+
+INSERT_DOCUMENT = 'INSERT INTO search_documents (kind, profile_id, item_id, title, body) VALUES (?, ?, ?, ?, ?)'
+
+def replace_documents(db, kind, profile_id, documents):
+    statements = [('DELETE FROM search_documents WHERE kind = ? AND profile_id = ?', (kind, profile_id))]
+    for item_id, title, body in documents:
+        if body:
+            statements.append((INSERT_DOCUMENT, (kind, profile_id, None if item_id is None else str(item_id), title, body)))
+    db.execute_group(statements)
+
+# Function to (re)index all comments of a profile, one document per comment
+def index_comments(db, profile_id, comments, text_field='comment', id_field='id'):
+    replace_documents(db, 'comment', profile_id, (
+        (comment.get(id_field), None, comment.get(text_field)) for comment in comments))
+
+# Function to (re)index a wiki record: its summary and each section
+def index_wiki(db, profile_id, data):
+    title = data.get('title')
+    documents = [(None, title, data.get('summary'))]
+    for section, text in (data.get('sections') or {}).items():
+        documents.append((section, f"{title} / {section}", text))
+    replace_documents(db, 'wiki', profile_id, documents)
+
+# Function to run a ranked search. `query` uses FTS5 syntax (words, "phrases", OR,
+# NOT, prefix*). Titles weigh twice as much as bodies; best matches come first.
+def search(conn, query, kind=None, profile_id=None, limit=20):
+    sql = '''
+        SELECT d.kind, d.profile_id, d.item_id, d.title,
+               snippet(search_index, -1, '[', ']', '...', 16) AS snippet,
+               bm25(search_index, 2.0, 1.0) AS rank
+        FROM search_index JOIN search_documents d ON d.id = search_index.rowid
+        WHERE search_index MATCH ?
+    '''
+    params = [query]
+    if kind:
+        sql += ' AND d.kind = ?'
+        params.append(kind)
+    if profile_id is not None:
+        sql += ' AND d.profile_id = ?'
+        params.append(profile_id)
+    sql += ' ORDER BY rank LIMIT ?'
+    params.append(limit)
+    return [dict(zip(('kind', 'profile_id', 'item_id', 'title', 'snippet', 'rank'), row))
+            for row in conn.execute(sql, params)]
+
+# Function to index every comment and wiki record already in the record store
+def build(db, store, config):
+    text_field = config.get('comment_text_field', 'comment')
+    id_field = config.get('comment_id_field', 'id')
+    for profile_id in tqdm(store.ids('comments'), desc="Indexing comments"):
+        index_comments(db, profile_id, store.read_items('comments', profile_id), text_field, id_field)
+    for profile_id in tqdm(store.ids('wiki'), desc="Indexing wiki pages"):
+        data = store.read('wiki', profile_id)
+        if data:
+            index_wiki(db, profile_id, data)
+    db.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search over comments and wiki content")
+    parser.add_argument('--db', default='personality_profiles.db')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="Index records already in the record store")
+    build_parser.add_argument('--comments-dir', default='data/comments')
+    build_parser.add_argument('--wiki-dir', default='data/wiki')
+    query_parser = subparsers.add_parser('query', help="Run a ranked keyword query")
+    query_parser.add_argument('query')
+    query_parser.add_argument('--kind', choices=['comment', 'wiki'])
+    query_parser.add_argument('--profile-id', type=int)
+    query_parser.add_argument('--limit', type=int, default=20)
+    subparsers.add_parser('optimize', help="Merge the index segments for faster queries")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.command == 'build':
+        with open('config.json') as f:
+            config = json.load(f)
+        db = Database.from_config(args.db, config)
+        db.execute_script(SEARCH_TABLES)
+        store = open_store(config, {'comments': args.comments_dir, 'wiki': args.wiki_dir})
+        try:
+            build(db, store, config)
+        finally:
+            store.close()
+            db.close()
+        return
+
+    conn = connect(args.db)
+    try:
+        if args.command == 'optimize':
+            conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+            conn.commit()
+            return
+        try:
+            results = search(conn, args.query, args.kind, args.profile_id, args.limit)
+        except sqlite3.OperationalError as e:
+            parser.error(f"invalid query: {str(e)}")
+        for result in results:
+            where = result['title'] or f"comment {result['item_id']}"
+            print(f"{result['rank']:8.2f}  {result['kind']:7}  profile {result['profile_id']}  {where}")
+            print(f"          {result['snippet']}")
+        print(f"{len(results)} results")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from persistence import connect
+
+# Shards of the profile ID space and who is working on them. A shard is `pending`
+# until a worker claims it, `leased` while the worker keeps sending heartbeats, and
+# `done` once completed. A lease that is not renewed before `expires_at` lapses and
+# the shard can be claimed again, so the shards of crashed workers are picked up by
+# the others. A shard handed back with retries still to come is `pending` with
+# `expires_at` set to when they are due, and cannot be claimed before then. Times
+# come from the clock of the process that owns the table.
+LEASE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS shard_leases (
+        shard_id INTEGER PRIMARY KEY,
+        end_id INTEGER,
+        status TEXT DEFAULT 'pending',
+        owner TEXT,
+        heartbeat_at REAL,
+        expires_at REAL,
+        attempts INTEGER DEFAULT 0,
+        completed_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_shard_leases_status ON shard_leases (status, expires_at);
+'''
+
+# Lease table in a local SQLite file, shared by the worker processes of one machine.
+# A shard is identified by its first ID and covers [shard_id, end_id).
+class LeaseStore:
+    def __init__(self, path, lease_seconds=300):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        self.conn = connect(path)
+        self.conn.isolation_level = None
+        self.conn.executescript(LEASE_TABLE)
+
+    # Function to split [start_id, end_id) into shards of `shard_size` IDs; shards
+    # that already exist, done or not, are left alone
+    def plan(self, start_id, end_id, shard_size):
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.executemany('INSERT OR IGNORE INTO shard_leases (shard_id, end_id) VALUES (?, ?)',
+                                  [(shard_id, min(shard_id + shard_size, end_id))
+                                   for shard_id in range(start_id, end_id, shard_size)])
+            self.conn.execute('COMMIT')
+
+    # Function to lease the lowest pending or expired shard to `owner`; returns
+    # (shard_id, end_id) or None when every shard is done or leased
+    def claim(self, owner):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute('''
+                    SELECT shard_id, end_id, status, owner FROM shard_leases
+                    WHERE (status = 'pending' AND (expires_at IS NULL OR expires_at <= ?))
+                        OR (status = 'leased' AND expires_at < ?)
+                    ORDER BY shard_id LIMIT 1
+                ''', (now, now)).fetchone()
+                if row is not None:
+                    self.conn.execute('''
+                        UPDATE shard_leases SET status = 'leased', owner = ?, heartbeat_at = ?, expires_at = ?,
+                            attempts = attempts + 1
+                        WHERE shard_id = ?
+                    ''', (owner, now, now + self.lease_seconds, row[0]))
+            finally:
+                self.conn.execute('COMMIT')
+        if row is None:
+            return None
+        if row[2] == 'leased':
+            logging.warning(f"Reclaiming shard {row[0]}-{row[1] - 1} from {row[3]}, whose lease expired")
+        return row[0], row[1]
+
+    # Function to extend the lease; returns False if `owner` no longer holds it
+    def heartbeat(self, owner, shard_id):
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute('''
+                UPDATE shard_leases SET heartbeat_at = ?, expires_at = ?
+                WHERE shard_id = ? AND owner = ? AND status = 'leased'
+            ''', (now, now + self.lease_seconds, shard_id, owner))
+        return cursor.rowcount == 1
+
+    # Function to mark a shard done, or with `retry_in` (seconds) to hand it back until
+    # the retries of its failed IDs are due
+    def complete(self, owner, shard_id, retry_in=None):
+        now = time.time()
+        with self.lock:
+            if retry_in is None:
+                cursor = self.conn.execute('''
+                    UPDATE shard_leases SET status = 'done', completed_at = ?
+                    WHERE shard_id = ? AND owner = ? AND status = 'leased'
+                ''', (now, shard_id, owner))
+            else:
+                cursor = self.conn.execute('''
+                    UPDATE shard_leases SET status = 'pending', expires_at = ?
+                    WHERE shard_id = ? AND owner = ? AND status = 'leased'
+                ''', (now + retry_in, shard_id, owner))
+        return cursor.rowcount == 1
+
+    # Function to hand a shard back unfinished (e.g. on shutdown) so it is claimed at once
+    def release(self, owner, shard_id):
+        with self.lock:
+            cursor = self.conn.execute('''
+                UPDATE shard_leases SET status = 'pending', expires_at = NULL
+                WHERE shard_id = ? AND owner = ? AND status = 'leased'
+            ''', (shard_id, owner))
+        return cursor.rowcount == 1
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            rows = self.conn.execute('''
+                SELECT CASE WHEN status = 'leased' AND expires_at < ? THEN 'expired'
+                            WHEN status = 'pending' AND expires_at > ? THEN 'waiting_for_retries'
+                            ELSE status END, COUNT(*)
+                FROM shard_leases GROUP BY 1
+            ''', (now, now)).fetchall()
+            owners = self.conn.execute('''
+                SELECT owner, shard_id, end_id, heartbeat_at FROM shard_leases
+                WHERE status = 'leased' AND expires_at >= ? ORDER BY shard_id
+            ''', (now,)).fetchall()
+        return {
+            'shards': dict(rows),
+            'leases': [{'owner': owner, 'shard': f"{shard_id}-{end_id - 1}", 'heartbeat_age': round(now - heartbeat_at, 1)}
+                       for owner, shard_id, end_id, heartbeat_at in owners]
+        }
+
+    def close(self):
+        self.conn.close()
+
+# Lease table behind a coordinator started with `python shard_leases.py serve`, for
+# workers on several machines. Same methods as LeaseStore.
+class RemoteLeaseStore:
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _post(self, action, **payload):
+        response = self.session.post(f"{self.url}/{action}", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()['result']
+
+    def plan(self, start_id, end_id, shard_size):
+        return self._post('plan', start_id=start_id, end_id=end_id, shard_size=shard_size)
+
+    def claim(self, owner):
+        result = self._post('claim', owner=owner)
+        return tuple(result) if result else None
+
+    def heartbeat(self, owner, shard_id):
+        return self._post('heartbeat', owner=owner, shard_id=shard_id)
+
+    def complete(self, owner, shard_id, retry_in=None):
+        return self._post('complete', owner=owner, shard_id=shard_id, retry_in=retry_in)
+
+    def release(self, owner, shard_id):
+        return self._post('release', owner=owner, shard_id=shard_id)
+
+    def stats(self):
+        response = self.session.get(f"{self.url}/status", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+# Function to open the lease table selected in config.json: the coordinator at
+# coordinator_url if set, else the table in `db_file`
+def open_lease_store(config, db_file):
+    if config.get('coordinator_url'):
+        return RemoteLeaseStore(config['coordinator_url'])
+    return LeaseStore(db_file, config.get('lease_seconds', 300))
+
+# Background heartbeat for one claimed shard. `lost` is set once the lease has been
+# taken over (the worker was presumed dead), after which the shard must not be completed.
+class LeaseKeeper:
+    def __init__(self, store, owner, shard_id, interval):
+        self.store = store
+        self.owner = owner
+        self.shard_id = shard_id
+        self.interval = interval
+        self.lost = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='lease-heartbeat', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                if not self.store.heartbeat(self.owner, self.shard_id):
+                    logging.error(f"Lost the lease on shard {self.shard_id}; another worker has taken it over")
+                    self.lost.set()
+                    return
+            except Exception as e:
+                logging.warning(f"Heartbeat for shard {self.shard_id} failed: {str(e)}")
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/status':
+            return self.send_json(404, {'error': 'Not found'})
+        self.send_json(200, self.server.store.stats())
+
+    def do_POST(self):
+        store = self.server.store
+        actions = {'plan': store.plan, 'claim': store.claim, 'heartbeat': store.heartbeat,
+                   'complete': store.complete, 'release': store.release}
+        action = actions.get(self.path.strip('/'))
+        if action is None:
+            return self.send_json(404, {'error': 'Not found'})
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            result = action(**payload)
+        except (TypeError, ValueError) as e:
+            return self.send_json(400, {'error': str(e)})
+        self.send_json(200, {'result': result})
+
+def main():
+    parser = argparse.ArgumentParser(description="Coordinate sharded scraping across worker processes")
+    parser.add_argument('--db', default='personality_profiles.db', help="SQLite file holding the lease table")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help="Serve the lease table to workers on other machines")
+    serve_parser.add_argument('--host', default='0.0.0.0')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--lease-seconds', type=int, default=300)
+    subparsers.add_parser('status', help="Show shard counts and live leases")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    store = LeaseStore(args.db, getattr(args, 'lease_seconds', 300))
+    try:
+        if args.command == 'status':
+            print(json.dumps(store.stats(), indent=2))
+            return
+        server = ThreadingHTTPServer((args.host, args.port), CoordinatorHandler)
+        server.store = store
+        logging.info(f"Coordinating shards from {args.db} on {args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 import sqlite3
 import pandas as pd
-import os
 import json
-import tqdm
+import argparse
+from export_engine import load_votes, load_votes_from_db, long_view
+from columnar import write_columnar
+from export_manifest import export_incremental
 
 # Step 1: Extract Data from SQLite Database
 
@@ -19,67 +21,51 @@ def extract_data_from_sqlite(db_path):
 
     return profiles_df
 
-# Step 2: Read JSON Files
-
-def read_json_file(profile_id, json_folder_path):
-    file_path = os.path.join(json_folder_path, f'{profile_id}_typing.json')
-    with open(file_path, 'r') as file:
-        data = json.load(file)
-        
-
-    return data
-
-# Step 3: Merge Data
-
-def merge_data(profiles_df, json_folder_path):
-    combined_data = []
-    n = 1
-
-    # Iterate over profiles and merge JSON data
-    for index, row in profiles_df.iterrows():
-        
-        profile_id = row['id']
-        json_data = read_json_file(profile_id, json_folder_path)
-        
-        # Extract the breakdown_systems data
-        breakdown_systems = json_data.get('breakdown_systems', {})
-        
-        # Iterate through each system in breakdown_systems
-        for system_id, votes in breakdown_systems.items():
-            for vote in votes:
-                combined_entry = {
-                    'id': profile_id,
-                    'mbti_profile': row['mbti_profile'],
-                    'wiki_description': row['wiki_description'],
-                    'sub_cat_id': row['sub_cat_id'],
-                    'cat_id': row['cat_id'],
-                    'property_id': row['property_id'],
-                    'total_vote_counts': row['total_vote_counts'],
-                    'system_id': system_id,
-                    'personality_type': vote['personality_type'],
-                    'vote_count': vote['theCount']
-                }
-                combined_data.append(combined_entry)
-        n += 1
-        print(f"Processed {n} profiles")
-
-    # Convert combined data into a dataframe
-    combined_df = pd.DataFrame(combined_data)
-    return combined_df
-
-# Step 4: Save or Use the Combined Dataframe
-
-def save_combined_data(combined_df, output_path):
-    # Save to CSV
-    combined_df.to_csv(output_path, index=False)
-
-db_path = 'personality_profiles.db'
-json_folder_path = 'C:/Users/abdel/Desktop/Nyx/data/typing/'
-output_path = 'combined_data.csv'
-
-profiles_df = extract_data_from_sqlite(db_path)
-combined_df = merge_data(profiles_df, json_folder_path)
-save_combined_data(combined_df, output_path)
-
-# Display the combined dataframe
-print(combined_df.head())
+# Step 2: Merge Data
+
+def merge_data(profiles_df, config, dirs, jobs=1, votes_db=None):
+    # Flatten every profile's votes into one long table, then join the profile columns once
+    if votes_db:
+        votes = load_votes_from_db(votes_db, profiles_df['id'].tolist())
+    else:
+        votes = load_votes(config, dirs, profiles_df['id'].tolist(), jobs=jobs)
+    return long_view(profiles_df, votes)
+
+# Step 3: Save or Use the Combined Dataframe
+
+def save_combined_data(combined_df, output_path, output_format='csv'):
+    # Save to CSV, or to a columnar archive
+    if output_format == 'npz':
+        write_columnar(combined_df, output_path)
+    else:
+        combined_df.to_csv(output_path, index=False)
+
+# Worker processes re-import this module, so the script only runs as __main__
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=1, help="Worker processes used to load typing data")
+    parser.add_argument('--output_format', choices=['csv', 'npz'], default='csv')
+    parser.add_argument('--incremental', action='store_true',
+                        help="Rebuild only new or changed profiles and patch the previous output")
+    parser.add_argument('--from_db', action='store_true',
+                        help="Read typing votes from the SQLite typing tables instead of the typing records")
+    args = parser.parse_args()
+
+    db_path = 'personality_profiles.db'
+    json_folder_path = 'C:/Users/abdel/Desktop/Nyx/data/typing/'
+    output_path = f'combined_data.{args.output_format}'
+    with open('config.json') as f:
+        config = json.load(f)
+
+    profiles_df = extract_data_from_sqlite(db_path)
+    dirs = {'typing': json_folder_path}
+    votes_db = db_path if args.from_db else None
+    if args.incremental:
+        combined_df = export_incremental(profiles_df, lambda df: merge_data(df, config, dirs, args.jobs, votes_db),
+                                         config, dirs, ['typing'], output_path, args.output_format)
+    else:
+        combined_df = merge_data(profiles_df, config, dirs, args.jobs, votes_db)
+        save_combined_data(combined_df, output_path, args.output_format)
+
+    # Display the combined dataframe
+    print(combined_df.head())
@@ -0,0 +1,124 @@
+import argparse
+import json
+import logging
+from tqdm import tqdm
+from persistence import Database
+from record_store import open_store
+
+# Typing votes normalized out of the typing records, plus aggregates kept up to date
+# as profiles are saved:
+# - typing_votes: every vote of every profile, in the order of breakdown_systems
+# - typing_top_votes: the highest voted type per profile and system (ties go to the
+#   first vote listed, like the exporters)
+# - typing_type_distribution: how many profiles of each cat_id have each type as
+#   their top type for a system
+TYPING_TABLES = '''
+    CREATE TABLE IF NOT EXISTS typing_votes (
+        profile_id INTEGER,
+        position INTEGER,
+        system_id INTEGER,
+        personality_type TEXT,
+        theCount INTEGER,
+        PRIMARY KEY (profile_id, position)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_typing_votes_system ON typing_votes (system_id, personality_type);
+    CREATE TABLE IF NOT EXISTS typing_top_votes (
+        profile_id INTEGER,
+        system_id INTEGER,
+        cat_id INTEGER,
+        personality_type TEXT,
+        theCount INTEGER,
+        PRIMARY KEY (profile_id, system_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_typing_top_votes_system ON typing_top_votes (system_id, personality_type);
+    CREATE TABLE IF NOT EXISTS typing_type_distribution (
+        cat_id INTEGER,
+        system_id INTEGER,
+        personality_type TEXT,
+        profiles INTEGER,
+        PRIMARY KEY (cat_id, system_id, personality_type)
+    ) WITHOUT ROWID;
+'''
+
+OLD_TOP_VOTES = 'SELECT cat_id, system_id, personality_type FROM typing_top_votes WHERE profile_id = ?'
+
+# Function to pick the highest voted entry per system, first listed on ties
+def top_votes(breakdown_systems):
+    tops = []
+    for system_id, votes in breakdown_systems.items():
+        if votes:
+            top = max(votes, key=lambda vote: vote['theCount'])
+            tops.append((system_id, top['personality_type'], top['theCount']))
+    return tops
+
+# Function to replace a profile's votes and move its share of the aggregates from its
+# old top types to the new ones. The statements are queued as one group, so the -1 and
+# +1 aggregate updates are committed together or not at all, after those queued before.
+def save_typing_votes(db, profile_id, cat_id, typing_data):
+    breakdown_systems = typing_data.get('breakdown_systems', {}) or {}
+    statements = [
+        (f'''
+            UPDATE typing_type_distribution SET profiles = profiles - 1
+            WHERE (cat_id, system_id, personality_type) IN ({OLD_TOP_VOTES})
+        ''', (profile_id,)),
+        (f'''
+            DELETE FROM typing_type_distribution
+            WHERE profiles <= 0 AND (cat_id, system_id, personality_type) IN ({OLD_TOP_VOTES})
+        ''', (profile_id,)),
+        ('DELETE FROM typing_top_votes WHERE profile_id = ?', (profile_id,)),
+        ('DELETE FROM typing_votes WHERE profile_id = ?', (profile_id,))
+    ]
+
+    position = 0
+    for system_id, votes in breakdown_systems.items():
+        for vote in votes:
+            statements.append(('''
+                INSERT INTO typing_votes (profile_id, position, system_id, personality_type, theCount)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (profile_id, position, system_id, vote['personality_type'], vote['theCount'])))
+            position += 1
+    for system_id, personality_type, count in top_votes(breakdown_systems):
+        statements.append(('''
+            INSERT INTO typing_top_votes (profile_id, system_id, cat_id, personality_type, theCount)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (profile_id, system_id, cat_id, personality_type, count)))
+        statements.append(('''
+            INSERT INTO typing_type_distribution (cat_id, system_id, personality_type, profiles)
+            VALUES (?, ?, ?, 1)
+            ON CONFLICT (cat_id, system_id, personality_type) DO UPDATE SET profiles = profiles + 1
+        ''', (cat_id, system_id, personality_type)))
+    db.execute_group(statements)
+
+# Function to fill the tables from typing records already in the record store
+def backfill(db, store):
+    profiles = db.fetchall('SELECT id, cat_id FROM profiles ORDER BY id')
+    missing = 0
+    for profile_id, cat_id in tqdm(profiles, desc="Indexing typing votes"):
+        typing_data = store.read('typing', profile_id)
+        if typing_data is None:
+            missing += 1
+            continue
+        save_typing_votes(db, profile_id, cat_id, typing_data)
+    db.flush()
+    logging.info(f"Indexed typing votes of {len(profiles) - missing} profiles ({missing} without typing data)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the typing vote tables from stored typing records")
+    parser.add_argument('--db', default='personality_profiles.db')
+    parser.add_argument('--typing-dir', default='data/typing')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with open('config.json') as f:
+        config = json.load(f)
+    db = Database.from_config(args.db, config)
+    db.execute_script(TYPING_TABLES)
+    store = open_store(config, {'typing': args.typing_dir})
+    try:
+        backfill(db, store)
+    finally:
+        store.close()
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,20 @@
 import wikipediaapi
+import requests
 import json
-import time
 import logging
-import sqlite3
-import os
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from rate_limiter import RateLimiter
+from persistence import Database
+from record_store import open_store
+from search_index import SEARCH_TABLES, index_wiki
+from http_cache import CacheMiss, ResponseCache, cached_get
+from id_set import IdBitmap
+from metrics import MetricsExporter, observe_request, registry
+
+# Load configuration from file
+with open('config.json') as f:
+    config = json.load(f)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -12,12 +22,69 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Define a detailed custom user agent
 USER_AGENT = 'DataScience-WikipediaBot/1.0 (th3hermit@protonmail.com)'
 
+# Shared limiter applied to every Wikipedia API call
+rate_limiter = RateLimiter.from_config(config, 'wiki_rate_limit')
+
+# Action API endpoint; {language} is filled in with the wiki's language code
+WIKI_API_URL = config.get('wiki_api_url', 'https://{language}.wikipedia.org/w/api.php')
+
+# On-disk cache of API responses (None unless http_cache or http_cache_offline is set)
+response_cache = ResponseCache.from_config(config)
+
+WIKI_PAGES = registry.counter('scraper_wiki_pages_total', 'Wiki records saved, errors recorded and names answered from the title cache',
+                              ('outcome',))
+
+# Metrics endpoint / file (None unless wiki_metrics_port or wiki_metrics_file is set)
+metrics_exporter = MetricsExporter.from_config(config, 'wiki_metrics')
+
+# Function to GET an API response through the rate limiter and the response cache;
+# returns the decoded JSON
+def get_json(url, params):
+    full_url = requests.Request('GET', url, params=params).prepare().url
+    def send(headers):
+        rate_limiter.wait(url)
+        started = time.monotonic()
+        try:
+            response = wiki_wiki._session.get(full_url, headers=headers, **wiki_wiki._request_kwargs)
+        except requests.exceptions.RequestException:
+            observe_request(url, time.monotonic() - started, None)
+            raise
+        observe_request(url, time.monotonic() - started, response.status_code, len(response.content))
+        return response.status_code, response.content, response.headers
+    status, raw = cached_get(response_cache, full_url, send)
+    if status != 200:
+        raise requests.exceptions.HTTPError(f"Status code {status} for {full_url}")
+    return raw
+
+# Wikipedia client that passes each API call (including the lazy ones made by
+# page attributes) through the rate limiter and the response cache
+class RateLimitedWikipedia(wikipediaapi.Wikipedia):
+    def _query(self, page, params):
+        params['format'] = 'json'
+        params['redirects'] = 1
+        return get_json(WIKI_API_URL.format(language=page.language), params)
+
 # Initialize Wikipedia API with the custom user agent
-wiki_wiki = wikipediaapi.Wikipedia(user_agent=USER_AGENT)
+wiki_wiki = RateLimitedWikipedia(user_agent=USER_AGENT)
+wiki_wiki._session.hooks['response'].append(rate_limiter.response_hook)
 
-# Ensure the output directory exists
+# Batched mode resolves up to `wiki_batch_size` titles per API request (the API allows 50);
+# 0 or 1 fetches each page on its own through wiki_wiki
+BATCH_SIZE = min(config.get('wiki_batch_size', 20), 50)
+WIKI_WORKERS = config.get('wiki_workers', 2)
+# Whole-page extracts (summary and sections) come back one page per request; intro-only
+# extracts come back for 20 pages at once but leave the sections empty
+FULL_TEXT = config.get('wiki_full_text', True)
+API_URL = WIKI_API_URL.format(language=wiki_wiki.language)
+
+DB_FILE = 'personality_profiles.db'
+
+# Writes are queued to a single batching writer thread; reads use pooled connections
+db = Database.from_config(DB_FILE, config)
+
+# Wiki records go through the storage backend selected in config.json
 output_dir = 'data/wiki'
-os.makedirs(output_dir, exist_ok=True)
+store = open_store(config, {'wiki': output_dir})
 
 def fetch_wikipedia_content(page_name):
     try:
@@ -25,8 +92,12 @@ def fetch_wikipedia_content(page_name):
         if not page.exists():
             error_message = f"Page '{page_name}' does not exist."
             logging.warning(error_message)
+            cache_title(page_name, None)
             return None, error_message
         return page, None
+    except CacheMiss as e:
+        logging.warning("Skipping '%s': %s", page_name, e)
+        return None, None
     except Exception as e:
         error_message = f"Error fetching page '{page_name}': {str(e)}"
         logging.error(error_message)
@@ -50,36 +121,94 @@ def extract_info(page):
         for section in page.sections:
             data['sections'][section.title] = extract_section_text(section)
         return data, None
+    except CacheMiss as e:
+        logging.warning("Skipping '%s': %s", page.title, e)
+        return None, None
     except Exception as e:
         error_message = f"Error extracting information from page '{page.title}': {str(e)}"
         logging.error(error_message)
         return None, error_message
 
-def save_to_json(data, filename):
+# Function to save a page record; returns False (with the failure in wiki_errors, so the
+# profile is not marked completed and is tried again next run) if it could not be saved
+def save_to_json(data, celeb_id, celeb_name):
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        logging.info("Data saved to %s", filename)
+        store.write('wiki', celeb_id, data)
+        if config.get('search_index', True):
+            index_wiki(db, celeb_id, data)
+        WIKI_PAGES.inc(('saved',))
+        logging.info("Wiki data saved for ID %d", celeb_id)
+        return True
     except Exception as e:
         logging.error("Error saving data to JSON: %s", e)
+        save_error(celeb_id, celeb_name, f"Error saving page '{data.get('title', celeb_name)}': {str(e)}")
+        return False
+
+# Profiles whose wiki lookup is finished (record saved or page confirmed missing),
+# kept as a bitmap in memory. Each completion is queued to the database writer,
+# which commits them in batches.
+completed_ids = IdBitmap()
+registry.gauge('scraper_wiki_completed', 'Profiles whose wiki lookup is finished').track(lambda: len(completed_ids))
+
+def load_completed():
+    for (celeb_id,) in db.fetchall("SELECT id FROM wiki_completed"):
+        completed_ids.add(celeb_id)
 
-def save_progress(celeb_id):
+def mark_completed(celeb_id):
+    completed_ids.add(celeb_id)
     try:
-        conn = sqlite3.connect('personality_profiles.db')
-        cursor = conn.cursor()
-        cursor.execute("INSERT OR REPLACE INTO wiki_progress (id, last_processed_id) VALUES (1, ?)", (celeb_id,))
-        conn.commit()
-        conn.close()
+        db.execute("INSERT OR REPLACE INTO wiki_completed (id) VALUES (?)", (celeb_id,))
     except Exception as e:
         logging.error("Error saving progress: %s", e)
 
+# Page names resolved so far: name -> (canonical title, or None if there is no such
+# page; ID of the profile whose record holds the page). Consulted before any request,
+# so repeated names are copied from that record and known-missing names cost nothing.
+title_cache = {}
+
+def load_title_cache():
+    for name, title, profile_id in db.fetchall("SELECT name, title, profile_id FROM wiki_titles"):
+        title_cache[name] = (title, profile_id)
+
+def cache_title(name, title, profile_id=None):
+    title_cache[name] = (title, profile_id)
+    try:
+        db.execute("INSERT OR REPLACE INTO wiki_titles (name, title, profile_id) VALUES (?, ?, ?)", (name, title, profile_id))
+    except Exception as e:
+        logging.error("Error saving title: %s", e)
+
+# Function to remember a saved page under the name it was requested by and its title
+def cache_page(celeb_name, info, celeb_id):
+    cache_title(celeb_name, info['title'], celeb_id)
+    if info['title'] != celeb_name:
+        cache_title(info['title'], info['title'], celeb_id)
+
+# Function to finish a celebrity from the title cache alone; returns False if a request is needed
+def resolve_from_cache(celeb_id, celeb_name):
+    if celeb_name not in title_cache:
+        return False
+    title, profile_id = title_cache[celeb_name]
+    if title is None:
+        save_error(celeb_id, celeb_name, f"Page '{celeb_name}' does not exist.")
+        mark_completed(celeb_id)
+        WIKI_PAGES.inc(('cached',))
+        return True
+    data = store.read('wiki', profile_id) if profile_id is not None else None
+    if data is None:
+        return False
+    logging.info("Reusing the page of ID %d for %s (ID: %d)", profile_id, celeb_name, celeb_id)
+    if save_to_json(data, celeb_id, celeb_name):
+        mark_completed(celeb_id)
+        WIKI_PAGES.inc(('cached',))
+    return True
+
+# Name to request: the canonical title if the name was resolved before
+def request_title(celeb_name):
+    return (title_cache.get(celeb_name) or (None,))[0] or celeb_name
+
 def load_progress():
     try:
-        conn = sqlite3.connect('personality_profiles.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT last_processed_id FROM wiki_progress WHERE id = 1")
-        row = cursor.fetchone()
-        conn.close()
+        row = db.fetchone("SELECT last_processed_id FROM wiki_progress WHERE id = 1")
         if row:
             return row[0]
     except Exception as e:
@@ -88,88 +217,209 @@ def load_progress():
 
 def save_error(celeb_id, celeb_name, error_message):
     try:
-        conn = sqlite3.connect('personality_profiles.db')
-        cursor = conn.cursor()
-        cursor.execute("""
+        db.execute("""
             INSERT INTO wiki_errors (celeb_id, celeb_name, error_message)
             VALUES (?, ?, ?)
         """, (celeb_id, celeb_name, error_message))
-        conn.commit()
-        conn.close()
+        WIKI_PAGES.inc(('error',))
     except Exception as e:
         logging.error("Error saving to wiki_errors table: %s", e)
 
 def create_tables():
     try:
-        conn = sqlite3.connect('personality_profiles.db')
-        cursor = conn.cursor()
-        # Create the progress table if it doesn't exist
-        cursor.execute("""
+        db.execute_script("""
+            -- Create the progress table if it doesn't exist
             CREATE TABLE IF NOT EXISTS wiki_progress (
                 id INTEGER PRIMARY KEY,
                 last_processed_id INTEGER
-            )
-        """)
-        # Create the errors table if it doesn't exist
-        cursor.execute("""
+            );
+            -- Profiles whose lookup is finished, in any order
+            CREATE TABLE IF NOT EXISTS wiki_completed (
+                id INTEGER PRIMARY KEY
+            );
+            -- Page name -> canonical title (NULL if there is no such page)
+            CREATE TABLE IF NOT EXISTS wiki_titles (
+                name TEXT PRIMARY KEY,
+                title TEXT,
+                profile_id INTEGER
+            );
+            -- Create the errors table if it doesn't exist
             CREATE TABLE IF NOT EXISTS wiki_errors (
                 error_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 celeb_id INTEGER,
                 celeb_name TEXT,
                 error_message TEXT,
                 error_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.commit()
-        conn.close()
+            );
+        """ + (SEARCH_TABLES if config.get('search_index', True) else ''))
     except Exception as e:
         logging.error("Error creating tables: %s", e)
 
 def process_celebrity(celeb_id, celeb_name):
+    if resolve_from_cache(celeb_id, celeb_name):
+        return
     logging.info("Fetching data for %s (ID: %d)...", celeb_name, celeb_id)
-    page, error_message = fetch_wikipedia_content(celeb_name)
+    page_name = request_title(celeb_name)
+    page, error_message = fetch_wikipedia_content(page_name)
     if page:
         info, extract_error = extract_info(page)
         if info:
-            filename = os.path.join(output_dir, f"{celeb_id}_wiki.json")
-            save_to_json(info, filename)
-            save_progress(celeb_id)
+            if save_to_json(info, celeb_id, celeb_name):
+                cache_page(celeb_name, info, celeb_id)
+                mark_completed(celeb_id)
         elif extract_error:
             save_error(celeb_id, celeb_name, extract_error)
     elif error_message:
         save_error(celeb_id, celeb_name, error_message)
+        if page_name in title_cache and title_cache[page_name][0] is None:
+            # The page does not exist
+            cache_title(celeb_name, None)
+            mark_completed(celeb_id)
+
+# Function to run one action API query, following continuations and merging the
+# per-page results (categories are spread over several responses)
+def query_pages(params):
+    params = dict(params, action='query', format='json', redirects=1)
+    pages = {}
+    normalized = {}
+    redirects = {}
+    continue_params = {}
+    while True:
+        raw = get_json(API_URL, dict(params, **continue_params))
+        if 'error' in raw:
+            raise Exception(raw['error'].get('info', raw['error']))
+        query = raw.get('query', {})
+        normalized.update((item['from'], item['to']) for item in query.get('normalized', []))
+        redirects.update((item['from'], item['to']) for item in query.get('redirects', []))
+        for page_id, result in query.get('pages', {}).items():
+            page = pages.setdefault(page_id, {})
+            categories = page.get('categories', []) + result.get('categories', [])
+            page.update(result)
+            if categories:
+                page['categories'] = categories
+        if 'continue' not in raw:
+            return pages, normalized, redirects
+        continue_params = raw['continue']
+
+# Function to turn a merged query result into a WikipediaPage with its info,
+# categories and extract already filled in, so extract_info makes no further calls
+def build_page(result):
+    page = wiki_wiki.page(result['title'])
+    wiki_wiki._build_info({k: v for k, v in result.items() if k not in ('extract', 'categories')}, page)
+    wiki_wiki._build_categories(result, page)
+    wiki_wiki._build_extracts({'extract': result.get('extract', '')}, page)
+    page._called.update(info=True, categories=True, extracts=True)
+    return page
+
+# Function to fetch a batch of celebrities with shared requests: normalization,
+# redirects, existence, URL, categories and extracts for all titles together
+def fetch_wikipedia_batch(celebrities):
+    params = {
+        'titles': '|'.join(dict.fromkeys(celeb_name for _, celeb_name in celebrities)),
+        'prop': 'info|categories|extracts',
+        'inprop': 'url',
+        'cllimit': 'max',
+        'explaintext': 1,
+        'exsectionformat': 'wiki'
+    }
+    if not FULL_TEXT:
+        params.update(exintro=1, exlimit='max')
+    pages, normalized, redirects = query_pages(params)
+    by_title = {result['title']: result for result in pages.values()}
+
+    results = []
+    for celeb_id, celeb_name in celebrities:
+        title = normalized.get(celeb_name, celeb_name)
+        result = by_title.get(redirects.get(title, title))
+        if result is None or 'missing' in result or 'invalid' in result:
+            results.append((celeb_id, celeb_name, None, f"Page '{celeb_name}' does not exist."))
+        else:
+            results.append((celeb_id, celeb_name, build_page(result), None))
+    return results
+
+def process_celebrity_batch(celebrities):
+    celebrities = [(celeb_id, celeb_name) for celeb_id, celeb_name in celebrities
+                   if not resolve_from_cache(celeb_id, celeb_name)]
+    if not celebrities:
+        return
+    logging.info("Fetching data for %d celebrities (IDs %d-%d)...", len(celebrities), celebrities[0][0], celebrities[-1][0])
+    try:
+        results = fetch_wikipedia_batch([(celeb_id, request_title(celeb_name)) for celeb_id, celeb_name in celebrities])
+    except CacheMiss as e:
+        logging.warning("Skipping batch: %s", e)
+        return
+    except Exception as e:
+        logging.error("Error fetching batch: %s", e)
+        for celeb_id, celeb_name in celebrities:
+            save_error(celeb_id, celeb_name, f"Error fetching page '{celeb_name}': {str(e)}")
+        return
+    for (celeb_id, celeb_name), (_, _, page, error_message) in zip(celebrities, results):
+        if page is None:
+            # fetch_wikipedia_batch only reports pages that do not exist
+            logging.warning(error_message)
+            save_error(celeb_id, celeb_name, error_message)
+            cache_title(celeb_name, None)
+            mark_completed(celeb_id)
+            continue
+        info, extract_error = extract_info(page)
+        if info:
+            if save_to_json(info, celeb_id, celeb_name):
+                cache_page(celeb_name, info, celeb_id)
+                mark_completed(celeb_id)
+        elif extract_error:
+            save_error(celeb_id, celeb_name, extract_error)
 
 def main():
     create_tables()
 
-    conn = sqlite3.connect('personality_profiles.db')
-    cursor = conn.cursor()
-
     # Retrieve the list of celebrities (property_id 1 for public figures and 2 for fictional characters)
-    cursor.execute("SELECT id, mbti_profile FROM profiles WHERE property_id IN (1, 2)")
-    celebrities = cursor.fetchall()
-    conn.close()
+    celebrities = db.fetchall("SELECT id, mbti_profile FROM profiles WHERE property_id IN (1, 2)")
+
+    load_completed()
+    load_title_cache()
+    if not len(completed_ids):
+        # Upgrade from the single high-water mark: IDs below it count as done only
+        # if their record was actually saved
+        last_processed_id = load_progress()
+        if last_processed_id is not None:
+            for celeb_id in store.ids('wiki'):
+                if celeb_id <= last_processed_id:
+                    mark_completed(celeb_id)
 
-    # Load the last processed ID
-    last_processed_id = load_progress()
-    if last_processed_id is not None:
-        # Skip the celebrities that have been processed
-        celebrities = [celeb for celeb in celebrities if celeb[0] > last_processed_id]
+    # Skip the celebrities that have been processed
+    celebrities = [celeb for celeb in celebrities if celeb[0] not in completed_ids]
+    logging.info("%d celebrities to process, %d already done, %d page names cached",
+                 len(celebrities), len(completed_ids), len(title_cache))
 
     try:
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            future_to_celeb = {executor.submit(process_celebrity, celeb_id, celeb_name): (celeb_id, celeb_name) for celeb_id, celeb_name in celebrities}
-            for future in as_completed(future_to_celeb):
-                celeb_id, celeb_name = future_to_celeb[future]
-                try:
-                    future.result()
-                except Exception as e:
-                    logging.error("Error processing %s (ID: %d): %s", celeb_name, celeb_id, e)
-                time.sleep(1)  # Sleep to avoid hitting Wikipedia's rate limits
+        with ThreadPoolExecutor(max_workers=WIKI_WORKERS) as executor:
+            if BATCH_SIZE > 1:
+                batches = [celebrities[i:i + BATCH_SIZE] for i in range(0, len(celebrities), BATCH_SIZE)]
+                future_to_batch = {executor.submit(process_celebrity_batch, batch): batch for batch in batches}
+                for future in as_completed(future_to_batch):
+                    batch = future_to_batch[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logging.error("Error processing batch (IDs %d-%d): %s", batch[0][0], batch[-1][0], e)
+            else:
+                future_to_celeb = {executor.submit(process_celebrity, celeb_id, celeb_name): (celeb_id, celeb_name) for celeb_id, celeb_name in celebrities}
+                for future in as_completed(future_to_celeb):
+                    celeb_id, celeb_name = future_to_celeb[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logging.error("Error processing %s (ID: %d): %s", celeb_name, celeb_id, e)
     except KeyboardInterrupt:
         logging.info("Process interrupted. Saving progress and exiting.")
     finally:
-        pass
+        store.close()
+        db.close()
+        if response_cache:
+            logging.info("HTTP cache summary: %s", response_cache.stats())
+            response_cache.close()
+        if metrics_exporter:
+            metrics_exporter.close()
 
 if __name__ == "__main__":
     main()